@@ -0,0 +1,92 @@
+from glob import glob
+from os import path
+
+import gfx
+
+# Frame sets: (files in play order, cache mode, size, steps each frame is shown, loops)
+# A glob pattern plays its files in name order, one step count applies to every frame
+FRAME_SETS = {
+    "powerup": (path.join("graphics", "POWERUP", "*.png"), "alpha", None, 10, True),
+    "explosion": (path.join("graphics", "explosion_1", "*.png"), "alpha", (200, 200), 4, False),
+    "title_ship": ([path.join("graphics", "TITLE_SHIP", "zx_delta_1.png"),
+                    path.join("graphics", "TITLE_SHIP", "zx_delta_2.png")], "alpha", None, (21, 79), True),
+    "gameover": (path.join("graphics", "GAMEOVER", "*.png"), "opaque", None, 1, False),
+}
+
+
+class FrameSet:
+    # Frames decoded once and shared by every playhead of the set
+    def __init__(self, name, files, mode="alpha", size=None, steps=1, loop=True):
+        if isinstance(files, str):
+            files = sorted(glob(files))
+        self.name = name
+        gfx.cache.pin((file, mode, size) for file in files)
+        self.frames = [gfx.cache.get(file, mode, size) for file in files]
+        if isinstance(steps, int):
+            steps = [steps] * len(self.frames)
+        self.steps = list(steps)
+        self.loop = loop
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+
+frame_sets = {}
+
+
+def frames(name):
+    frame_set = frame_sets.get(name)
+    if frame_set is None:
+        frame_set = frame_sets[name] = FrameSet(name, *FRAME_SETS[name])
+    return frame_set
+
+
+def preload():
+    for name in FRAME_SETS:
+        frames(name)
+    return len(frame_sets)
+
+
+def queue_preload():
+    for files, mode, size, steps, loop in FRAME_SETS.values():
+        if isinstance(files, str):
+            files = sorted(glob(files))
+        gfx.cache.pin((file, mode, size) for file in files)
+        for file in files:
+            gfx.loader.add(file, mode, size)
+
+
+class Playhead:
+    # Position within a shared frame set, the only animation state an instance owns
+    __slots__ = ("frame_set", "index", "timer", "done")
+
+    def __init__(self, name):
+        self.frame_set = frames(name)
+        self.index = 0
+        self.timer = 0
+        self.done = False
+
+    @property
+    def image(self):
+        return self.frame_set.frames[self.index]
+
+    def advance(self, steps=1):
+        if self.done:
+            return self.image
+        frame_set = self.frame_set
+        self.timer += steps
+        while self.timer >= frame_set.steps[self.index]:
+            self.timer -= frame_set.steps[self.index]
+            if self.index + 1 < len(frame_set.frames):
+                self.index += 1
+            elif frame_set.loop:
+                self.index = 0
+            else:
+                # Finished sets hold their last frame
+                self.done = True
+                self.timer = 0
+                break
+        return self.image
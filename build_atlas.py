@@ -0,0 +1,80 @@
+import json
+from glob import glob
+from os import environ, path
+
+environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame as pg
+
+# Packs the sprites in graphics/ into atlas pages plus a JSON index read by gfx.Atlas
+# Usage: python build_atlas.py
+
+PAGE_SIZE = 1024
+PADDING = 1
+# Full screen art gains nothing from sharing a page
+MAX_SPRITE_SIZE = 600
+
+
+def sprite_files(directory="graphics"):
+    files = glob(path.join(directory, "*.png")) + glob(path.join(directory, "*", "*.png"))
+    return sorted(f for f in files if not path.basename(f).startswith("atlas_"))
+
+
+def pack(sizes, page_size=PAGE_SIZE, padding=PADDING):
+    # Shelf packing, tallest first, opening a new page when one fills up
+    order = sorted(sizes, key=lambda name: (sizes[name][1], sizes[name][0]), reverse=True)
+    placements = {}
+    page = 0
+    x = y = shelf = 0
+    for name in order:
+        w, h = sizes[name]
+        if x + w > page_size:
+            x = 0
+            y += shelf + padding
+            shelf = 0
+        if y + h > page_size:
+            page += 1
+            x = y = shelf = 0
+        placements[name] = (page, x, y, w, h)
+        x += w + padding
+        shelf = max(shelf, h)
+    return placements, page + 1
+
+
+def build(directory="graphics"):
+    pg.display.init()
+    pg.display.set_mode((1, 1))
+
+    images = {}
+    for file in sprite_files(directory):
+        img = pg.image.load(file).convert_alpha()
+        w, h = img.get_size()
+        if w > MAX_SPRITE_SIZE or h > MAX_SPRITE_SIZE:
+            continue
+        images[file.replace(path.sep, "/")] = img
+
+    placements, page_count = pack({name: img.get_size() for name, img in images.items()})
+    heights = [0] * page_count
+    for page, x, y, w, h in placements.values():
+        heights[page] = max(heights[page], y + h)
+    pages = [pg.Surface((PAGE_SIZE, height), pg.SRCALPHA, 32) for height in heights]
+    for name, (page, x, y, w, h) in placements.items():
+        # Onto a cleared page, RGBA_MAX copies the pixels and alpha unchanged
+        pages[page].blit(images[name], (x, y), special_flags=pg.BLEND_RGBA_MAX)
+
+    page_files = []
+    for i, surf in enumerate(pages):
+        page_file = "atlas_" + str(i) + ".png"
+        pg.image.save(surf, path.join(directory, page_file))
+        page_files.append(page_file)
+
+    with open(path.join(directory, "atlas.json"), "w") as f:
+        json.dump({"pages": page_files, "sprites": placements}, f, indent=1, sort_keys=True)
+
+    pg.quit()
+    return len(placements), page_count
+
+
+if __name__ == "__main__":
+    sprites, page_count = build()
+    print("Packed " + str(sprites) + " sprites into " + str(page_count) + " atlas page(s)")
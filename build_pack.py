@@ -0,0 +1,89 @@
+import json
+import subprocess
+import sys
+from os import environ, path, replace
+from time import perf_counter
+
+environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import anim
+import gfx
+
+# Writes every image the game preloads, converted and scaled, into the pack read by gfx.AssetPack
+# Usage: python build_pack.py         build graphics/assets.pack
+#        python build_pack.py bench   time startup loading with and without the pack
+# Build with the same display format the game runs on, the pack is ignored otherwise
+
+BENCH_RUNS = 5
+
+
+def pack_jobs():
+    gfx.queue_preload()
+    anim.queue_preload()
+    jobs = gfx.loader.jobs
+    gfx.loader.jobs = []
+    return jobs
+
+
+def build(file=gfx.pack.file):
+    # Surfaces come from the normal loader, so they match what the game would convert itself
+    gfx.pack.enabled = False
+    entries = []
+    blobs = []
+    offset = 0
+    for source, mode, size in pack_jobs():
+        surf = gfx.cache.load(source, mode, size).copy()
+        pixels = surf.get_buffer().raw
+        entries.append({"file": source.replace(path.sep, "/"), "mode": mode, "size": size,
+                        "crc": gfx.file_crc(source), "w": surf.get_width(), "h": surf.get_height(),
+                        "pitch": surf.get_pitch(), "bitsize": surf.get_bitsize(),
+                        "masks": list(surf.get_masks()), "flags": surf.get_flags() & gfx.SRCALPHA,
+                        "colorkey": surf.get_colorkey(), "alpha": surf.get_alpha(), "offset": offset})
+        padding = -len(pixels) % gfx.PACK_ALIGN
+        blobs.append(pixels + b"\0" * padding)
+        offset += len(pixels) + padding
+
+    index = json.dumps({"display": gfx.display_format(), "entries": entries}).encode("utf-8")
+    # Written next to the pack and moved over it once complete, an interrupted build leaves the old pack alone
+    temp = file + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(gfx.PACK_HEADER.pack(gfx.PACK_MAGIC, gfx.PACK_VERSION, len(index)))
+        f.write(index)
+        f.write(b"\0" * (gfx.pack_data_start(len(index)) - gfx.PACK_HEADER.size - len(index)))
+        for blob in blobs:
+            f.write(blob)
+    replace(temp, file)
+    return len(entries), offset
+
+
+def time_preload(use_pack):
+    gfx.pack.enabled = use_pack
+    start = perf_counter()
+    gfx.preload()
+    anim.preload()
+    return (perf_counter() - start) * 1000
+
+
+def bench(runs=BENCH_RUNS):
+    # Every run is a fresh interpreter. The first run of each kind is the coldest one we can get
+    # without dropping the OS file cache, the rest show the warm startup.
+    results = {}
+    for label, use_pack in (("decode", "0"), ("pack", "1")):
+        times = []
+        for _ in range(runs):
+            out = subprocess.check_output([sys.executable, __file__, "time", use_pack])
+            times.append(float(out.split()[-1]))
+        results[label] = times
+        warm = sorted(times[1:])[len(times[1:]) // 2] if runs > 1 else times[0]
+        print(label + ": first " + str(round(times[0], 1)) + " ms, warm median " + str(round(warm, 1)) + " ms")
+    return results
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["time"]:
+        print(round(time_preload(sys.argv[2] == "1"), 3))
+    elif sys.argv[1:2] == ["bench"]:
+        bench()
+    else:
+        count, size = build()
+        print("Packed " + str(count) + " images (" + str(size // 1024) + " KB) into " + gfx.pack.file)
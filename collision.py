@@ -0,0 +1,84 @@
+from collections import defaultdict
+
+import pygame as pg
+
+import lru
+
+
+class MaskCache(lru.IdentityLRU):
+    # Masks keyed by surface identity, so every sprite sharing an image shares its mask
+    def __init__(self, limit=512):
+        lru.IdentityLRU.__init__(self, limit)
+
+    def get(self, surface):
+        return self.lookup(surface, None, pg.mask.from_surface, surface)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"masks": len(self), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+masks = MaskCache()
+
+
+class MaskedSprite(pg.sprite.Sprite):
+    # collide_mask reads .mask, which here always matches the current image
+    @property
+    def mask(self):
+        return masks.get(self.image)
+
+
+class SpatialHash:
+    # Uniform grid of sprites bucketed by the cells their rects cover
+    def __init__(self, cell_size=128):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.broadphase = 0
+        self.narrowphase = 0
+
+    def cells_for(self, rect):
+        size = self.cell_size
+        for cx in range(rect.left // size, max(rect.left, rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, max(rect.top, rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def clear(self):
+        self.cells.clear()
+
+    def insert(self, sprite):
+        for cell in self.cells_for(sprite.rect):
+            self.cells[cell].append(sprite)
+
+    def rebuild(self, sprites):
+        self.clear()
+        for sprite in sprites:
+            self.insert(sprite)
+
+    def query(self, rect):
+        # Sprites whose rects overlap rect, each returned once
+        found = []
+        seen = set()
+        for cell in self.cells_for(rect):
+            for sprite in self.cells.get(cell, ()):
+                if id(sprite) in seen:
+                    continue
+                seen.add(id(sprite))
+                self.broadphase += 1
+                if sprite.rect.colliderect(rect):
+                    found.append(sprite)
+        return found
+
+    def narrow(self, a, b, collided=pg.sprite.collide_mask):
+        self.narrowphase += 1
+        return collided(a, b)
+
+    def collide(self, sprite, collided=pg.sprite.collide_mask):
+        return [other for other in self.query(sprite.rect) if self.narrow(sprite, other, collided)]
+
+    def frame_stats(self):
+        # Tests since the last call, meant to be read once per frame
+        stats = (self.broadphase, self.narrowphase)
+        self.broadphase = 0
+        self.narrowphase = 0
+        return stats
@@ -2,3 +2,12 @@
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 1080
 FONT_SIZE = 30
+MIXER_CHANNELS = 8
+MUSIC_FADE_MS = 750
+SURFACE_BUDGET = 32 * 1024 * 1024
+DIRTY_RECTS = False
+DIRTY_THRESHOLD = 0.5
+DIRTY_MAX_RECTS = 512
+SCANLINE_QUALITY = "colorkey"
+BULLET_POOL_SIZE = 256
+PROJECTILE_CAPACITY = 4096
@@ -0,0 +1,181 @@
+import pygame as pg
+
+import anim
+import collision
+import gfx
+import snd
+from constants import SCREEN_WIDTH, SCREEN_HEIGHT, BULLET_POOL_SIZE
+
+# Culling per category: (pixels a sprite may stray past the screen, simulation steps it may live)
+# None skips that check, categories missing here are never culled
+CULLING = {
+    "player_bullets": (50, 300),
+    "enemy_bullets": (50, 900),
+    "powerups": (50, 1200),
+    "fighters": (100, 1800),
+    # Frigates enter from off the left edge
+    "frigates": (200, 1800),
+    "explosions": (None, 600),
+}
+
+
+class Registry:
+    # Sprites join the shared update/draw group and their category groups once, when spawned.
+    # kill() takes them out of every group at once, so nothing is re-added per frame.
+    def __init__(self, bounds=(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)):
+        self.all = pg.sprite.Group()
+        self.groups = {}
+        self.bounds = pg.Rect(bounds)
+        self.culling = dict(CULLING)
+        self.frame = 0
+        self.peak = 0
+        self.culled = 0
+        self.expired = 0
+
+    def group(self, category):
+        group = self.groups.get(category)
+        if group is None:
+            group = self.groups[category] = pg.sprite.Group()
+        return group
+
+    def spawn(self, sprite, *categories):
+        sprite.spawn_frame = self.frame
+        self.all.add(sprite)
+        for category in categories:
+            self.group(category).add(sprite)
+        self.peak = max(self.peak, len(self.all))
+        return sprite
+
+    def cull(self):
+        # Once per simulation step, after the sprites have moved
+        self.frame += 1
+        for category, (margin, lifetime) in self.culling.items():
+            if margin is not None:
+                area = self.bounds.inflate(margin * 2, margin * 2)
+            for sprite in self.group(category).sprites():
+                if margin is not None and not area.colliderect(sprite.rect):
+                    sprite.kill()
+                    self.culled += 1
+                elif lifetime is not None and self.frame - sprite.spawn_frame > lifetime:
+                    sprite.kill()
+                    self.expired += 1
+
+    def live(self):
+        return len(self.all)
+
+    def counts(self):
+        counts = {category: len(group) for category, group in self.groups.items()}
+        counts["all"] = len(self.all)
+        return counts
+
+    def stats(self):
+        return {"live": len(self.all), "peak": self.peak, "culled": self.culled, "expired": self.expired}
+
+
+registry = Registry()
+
+
+class Bullet(collision.MaskedSprite):
+    def __init__(self, x, y, image, pool=None):
+        pg.sprite.Sprite.__init__(self)
+        self.pool = pool
+        self.reset(x, y, image)
+
+    def reset(self, x, y, image):
+        self.image = image
+        self.rect = self.image.get_rect()
+        self.rect.center = (x, y)
+        self.size = (self.rect.x, self.rect.y)
+        self.dx = 0
+        self.dy = 0
+        self.last_pos = self.rect.topleft
+
+    def update(self):
+        x, y = self.rect.center
+        x += self.dx
+        y += self.dy
+        self.rect.center = x, y
+
+        if y <= 0:
+            self.kill()
+
+    def kill(self):
+        was_alive = self.alive()
+        pg.sprite.Sprite.kill(self)
+        if was_alive and self.pool is not None:
+            self.pool.release(self)
+
+    def on_hit(self):
+        gfx.effects.submit(gfx.img_hit, (self.rect.centerx - gfx.img_hit.get_width() / 2, self.rect.y), 2)
+
+
+class BulletPool:
+    # Bullets are handed out by acquire and come back here when killed, instead of being rebuilt per shot
+    def __init__(self, size=BULLET_POOL_SIZE):
+        self.size = size
+        self.free = []
+        self.in_use = 0
+        self.peak = 0
+        self.exhausted = 0
+        self.discarded = 0
+
+    def fill(self, image):
+        while len(self.free) + self.in_use < self.size:
+            self.free.append(Bullet(0, 0, image, self))
+
+    def acquire(self, x, y, image, dx=0, dy=0):
+        if self.free:
+            bullet = self.free.pop()
+            bullet.reset(x, y, image)
+        else:
+            # Past the pool size, so allocate one that is only kept if the pool has room when it dies
+            self.exhausted += 1
+            bullet = Bullet(x, y, image, self)
+        bullet.dx = dx
+        bullet.dy = dy
+        self.in_use += 1
+        self.peak = max(self.peak, self.in_use)
+        return bullet
+
+    def release(self, bullet):
+        self.in_use -= 1
+        if len(self.free) < self.size:
+            self.free.append(bullet)
+        else:
+            self.discarded += 1
+
+    def stats(self):
+        return {"size": self.size, "in_use": self.in_use, "free": len(self.free),
+                "peak": self.peak, "exhausted": self.exhausted, "discarded": self.discarded}
+
+
+bullets = BulletPool()
+
+
+class Explosion(pg.sprite.Sprite):
+    blank = None
+
+    def __init__(self, x, y, delay=0, sound=None):
+        pg.sprite.Sprite.__init__(self)
+        if Explosion.blank is None:
+            Explosion.blank = pg.Surface((1, 1), pg.SRCALPHA)
+        self.playhead = anim.Playhead("explosion")
+        self.delay = delay
+        self.sound = sound
+        self.image = self.blank if delay else self.playhead.image
+        self.rect = self.playhead.image.get_rect()
+        self.rect.topleft = (x - 80, y - 80)
+        registry.spawn(self, "explosions")
+
+    def update(self):
+        if self.delay > 0:
+            self.delay -= 1
+            return
+        if self.playhead.done:
+            self.kill()
+            return
+        if self.sound and self.playhead.index == 0 and self.playhead.timer == 0:
+            snd.load_sound(self.sound)
+
+        self.image = self.playhead.image
+        self.playhead.advance()
@@ -1,67 +1,755 @@
-from glob import *
-from os import path
+import json
+import mmap
+import struct
+import threading
+import zlib
+from collections import OrderedDict, deque
+from os import environ, path, sep
+from time import perf_counter
 
+import numpy
 from pygame import *
+from pygame import surfarray
 
 import constants
+import lru
+
+# Headless runs simulate on SDL's dummy drivers without presenting anything
+headless = environ.get("GALBLAZER_HEADLESS", "") not in ("", "0")
+if headless:
+    environ["SDL_VIDEODRIVER"] = "dummy"
+    environ["SDL_AUDIODRIVER"] = "dummy"
 
 screen = display.set_mode((constants.SCREEN_WIDTH, constants.SCREEN_HEIGHT))
 
 
+def merge_rects(rects):
+    # Grows overlapping rects into their unions until none of the results overlap
+    merged = []
+    for rect in rects:
+        rect = Rect(rect)
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+class DirtyRects:
+    # Regions drawn last frame and this frame, only their union is repainted and pushed
+    def __init__(self, threshold=constants.DIRTY_THRESHOLD, max_rects=constants.DIRTY_MAX_RECTS):
+        self.threshold = threshold
+        self.max_rects = max_rects
+        self.bounds = screen.get_rect()
+        self.previous = []
+        self.current = []
+        self.full = True
+        self.fraction = 1.0
+
+    def mark(self, rect):
+        rect = Rect(rect).clip(self.bounds)
+        if rect.w and rect.h:
+            self.current.append(rect)
+
+    def mark_all(self, rects):
+        for rect in rects:
+            self.mark(rect)
+
+    def invalidate(self):
+        self.full = True
+
+    def regions(self):
+        # None means the dirty area is past the threshold and a full redraw is cheaper
+        rects = self.previous + self.current
+        self.previous = self.current
+        self.current = []
+        # Merging is quadratic in the rect count, past max_rects a full redraw wins before the area is known
+        if self.full or len(rects) > self.max_rects:
+            self.full = False
+            self.fraction = 1.0
+            return None
+        merged = merge_rects(rects)
+        area = sum(rect.w * rect.h for rect in merged)
+        self.fraction = area / float(self.bounds.w * self.bounds.h)
+        if self.fraction > self.threshold:
+            return None
+        return merged
+
+
+class ScanlineFilter:
+    # CRT scanline overlay, from the original per-pixel alpha blit down to nothing at all
+    QUALITY_LEVELS = ("off", "rows", "colorkey", "alpha")
+    KEY = (255, 0, 255)
+
+    def __init__(self, quality=constants.SCANLINE_QUALITY):
+        self.layer = None
+        self.rows = None
+        self.cost_ms = 0.0
+        self.set_quality(quality)
+
+    def set_quality(self, quality):
+        if quality not in self.QUALITY_LEVELS:
+            raise ValueError("unknown scanline quality " + repr(quality))
+        self.quality = quality
+        self.prepared = False
+
+    def prepare(self):
+        self.prepared = True
+        self.layer = None
+        self.rows = None
+        if self.quality in ("off", "alpha"):
+            return
+
+        source = cache.get(*IMAGES["scanlines"])
+        alpha = surfarray.array_alpha(source)
+        if ((alpha != 0) & (alpha != 255)).any():
+            # Partial transparency only survives the full alpha blit
+            self.quality = "alpha"
+            return
+
+        if self.quality == "colorkey":
+            # Opaque or clear pixels only, so a colorkeyed RLE copy draws exactly the same
+            layer = Surface(source.get_size()).convert()
+            layer.fill(self.KEY)
+            layer.blit(source, (0, 0))
+            layer.set_colorkey(self.KEY, RLEACCEL)
+            self.layer = layer
+        else:
+            dark = alpha.min(axis=0) == 255
+            if (dark != (alpha.max(axis=0) == 255)).any() or not dark.any():
+                # Rows must be wholly dark or wholly clear
+                self.quality = "colorkey"
+                self.prepare()
+                return
+            self.rows = dark.nonzero()[0]
+            self.color = source.get_at((0, int(self.rows[0])))
+
+    def apply(self, rects=None):
+        if not self.prepared:
+            self.prepare()
+        start = perf_counter()
+        if rects is None:
+            rects = [screen.get_rect()]
+
+        if self.quality == "alpha":
+            source = cache.get(*IMAGES["scanlines"])
+            for rect in rects:
+                screen.blit(source, rect, rect)
+        elif self.quality == "colorkey":
+            for rect in rects:
+                screen.blit(self.layer, rect, rect)
+        elif self.quality == "rows":
+            pixels = surfarray.pixels2d(screen)
+            color = screen.map_rgb(self.color)
+            for rect in rects:
+                rows = self.rows[(self.rows >= rect.top) & (self.rows < rect.bottom)]
+                pixels[rect.left:rect.right, rows] = color
+            del pixels
+
+        # Moving average of the milliseconds spent per frame
+        self.cost_ms += ((perf_counter() - start) * 1000 - self.cost_ms) * 0.05
+
+
+scanline_filter = ScanlineFilter()
+
+# Set while the game renders in dirty rect mode
+dirty = None
+
+
+def invalidate():
+    # The next rendered frame repaints and presents the whole screen
+    if dirty is not None:
+        dirty.invalidate()
+
+
+class Effects:
+    # Transient images submitted by the simulation, composited by the renderer in one pass and
+    # dropped once their lifetime in simulation steps runs out
+    def __init__(self):
+        self.behind = []
+        self.above = []
+        self.submitted = 0
+
+    def __len__(self):
+        return len(self.behind) + len(self.above)
+
+    def submit(self, image, pos, lifetime=1, behind=False):
+        layer = self.behind if behind else self.above
+        layer.append([image, (round(pos[0]), round(pos[1])), lifetime])
+        self.submitted += 1
+
+    def step(self):
+        # Called before the simulation step, so effects submitted during it get rendered at least once
+        for layer in (self.behind, self.above):
+            for effect in layer:
+                effect[2] -= 1
+            layer[:] = [effect for effect in layer if effect[2] > 0]
+
+    def clear(self):
+        del self.behind[:]
+        del self.above[:]
+
+    def rects(self):
+        return [image.get_rect(topleft=pos) for layer in (self.behind, self.above) for image, pos, _ in layer]
+
+    def draw(self, surface, behind=False):
+        layer = self.behind if behind else self.above
+        if layer:
+            surface.blits([(image, pos) for image, pos, _ in layer], False)
+
+    def stats(self):
+        return {"active": len(self), "submitted": self.submitted}
+
+
+effects = Effects()
+
+
 def set_gamma(value):
     return display.set_gamma(value)
 
 
+class Atlas:
+    # Sprite pages written by build_atlas.py, handed out as subsurface views
+    def __init__(self, index=path.join("graphics", "atlas.json")):
+        self.index = index
+        self.page_files = []
+        self.pages = []
+        self.sprites = {}
+        self.read_index = False
+        self.loaded = False
+        self.pending = False
+
+    def read(self):
+        # Index only, the pages can then be decoded anywhere and handed to load
+        self.read_index = True
+        if not path.exists(self.index):
+            return False
+        with open(self.index) as f:
+            data = json.load(f)
+
+        built = path.getmtime(self.index)
+        directory = path.dirname(self.index)
+        self.page_files = [path.join(directory, page) for page in data["pages"]]
+        # Sprites edited since the last build load from their own file instead
+        self.sprites = {name: entry for name, entry in data["sprites"].items()
+                        if path.exists(name) and path.getmtime(name) <= built}
+        return True
+
+    def covers(self, file):
+        return file.replace(sep, "/") in self.sprites
+
+    def load(self, pages=None):
+        if not self.read_index:
+            self.read()
+        self.loaded = True
+        self.pending = False
+        if pages is None:
+            pages = [image.load(page) for page in self.page_files]
+        self.pages = [page.convert_alpha() for page in pages]
+        # The pages count against the surface budget
+        cache.evict()
+        return bool(self.pages)
+
+    def lookup(self, file):
+        if not self.loaded:
+            if self.pending:
+                # The loader is decoding the pages, anything needed before then loads from its own file
+                return None
+            self.load()
+        entry = self.sprites.get(file.replace(sep, "/"))
+        if entry is None:
+            return None
+        page, x, y, w, h = entry
+        return self.pages[page].subsurface((x, y, w, h))
+
+    def bytes(self):
+        return sum(surface_bytes(page) for page in self.pages)
+
+
+def display_format():
+    surf = display.get_surface()
+    return [surf.get_bitsize(), list(surf.get_masks())]
+
+
+def file_crc(file):
+    try:
+        with open(file, "rb") as f:
+            return zlib.crc32(f.read()) & 0xffffffff
+    except IOError:
+        return None
+
+
+# Magic, format version and index length, then the JSON index, then the pixel data
+PACK_MAGIC = b"GBPK"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<4sII")
+PACK_ALIGN = 16
+
+
+def pack_data_start(index_length):
+    end = PACK_HEADER.size + index_length
+    return end + -end % PACK_ALIGN
+
+
+class AssetPack:
+    # Surfaces written by build_pack.py already converted and scaled, copied out of a memory map
+    # instead of being decoded. Entries whose source file no longer matches its checksum are skipped.
+    def __init__(self, file=path.join("graphics", "assets.pack")):
+        self.file = file
+        self.enabled = True
+        self.opened = False
+        self.map = None
+        self.base = 0
+        self.entries = {}
+        self.stale = 0
+        self.hits = 0
+        self.reason = None
+
+    def open(self):
+        self.opened = True
+        if not self.enabled or not path.exists(self.file):
+            self.reason = "missing"
+            return False
+        # Anything unreadable, like a build that was cut short, is skipped and the images are decoded instead
+        if path.getsize(self.file) < PACK_HEADER.size:
+            return self.corrupt()
+        with open(self.file, "rb") as f:
+            # The map keeps its own handle to the file
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, length = PACK_HEADER.unpack_from(self.map, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            self.reason = "version"
+            return False
+        try:
+            index = json.loads(self.map[PACK_HEADER.size:PACK_HEADER.size + length].decode("utf-8"))
+            display_matches = index["display"] == display_format()
+        except (ValueError, KeyError, TypeError):
+            return self.corrupt()
+        # Pixels are stored in the display's format, a different display needs a rebuild
+        if not display_matches:
+            self.reason = "display format"
+            return False
+
+        self.base = pack_data_start(length)
+        checksums = {}
+        try:
+            for entry in index["entries"]:
+                if self.base + entry["offset"] + entry["h"] * entry["pitch"] > len(self.map):
+                    return self.corrupt()
+                source = entry["file"]
+                if source not in checksums:
+                    checksums[source] = file_crc(source.replace("/", sep))
+                if checksums[source] != entry["crc"]:
+                    self.stale += 1
+                    continue
+                size = tuple(entry["size"]) if entry["size"] else None
+                self.entries[(source, entry["mode"], size)] = entry
+        except (KeyError, TypeError):
+            return self.corrupt()
+        self.reason = None
+        return True
+
+    def corrupt(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.entries = {}
+        self.reason = "corrupt"
+        return False
+
+    def covers(self, file, mode, size):
+        return (file.replace(sep, "/"), mode, size) in self.entries
+
+    def lookup(self, file, mode, size):
+        if not self.opened:
+            self.open()
+        entry = self.entries.get((file.replace(sep, "/"), mode, size))
+        if entry is None:
+            return None
+        w, h, pitch = entry["w"], entry["h"], entry["pitch"]
+        surf = Surface((w, h), entry["flags"], entry["bitsize"], entry["masks"])
+        # Rows are copied as raw bytes, so this works whatever pixel size the display uses
+        row = w * surf.get_bytesize()
+        rows = numpy.frombuffer(self.map, numpy.uint8, h * pitch, self.base + entry["offset"]).reshape(h, pitch)
+        buffer = surf.get_buffer()
+        pixels = numpy.frombuffer(buffer, numpy.uint8).reshape(h, surf.get_pitch())
+        pixels[:, :row] = rows[:, :row]
+        del pixels, buffer
+        if entry["colorkey"] is not None:
+            surf.set_colorkey(entry["colorkey"])
+        if entry["alpha"] is not None and not entry["flags"]:
+            surf.set_alpha(entry["alpha"])
+        self.hits += 1
+        return surf
+
+    def stats(self):
+        return {"entries": len(self.entries), "stale": self.stale, "hits": self.hits, "skipped": self.reason}
+
+
+class SurfaceCache:
+    # Converted surfaces keyed by (file, mode, size), least recently used dropped first.
+    # Atlas sprites are views that cost nothing themselves, but the atlas pages count against the budget.
+    # Pinned keys are never dropped, sprites keep drawing those surfaces and a reload would only duplicate them.
+    def __init__(self, budget=constants.SURFACE_BUDGET):
+        self.budget = budget
+        self.surfaces = OrderedDict()
+        self.sizes = {}
+        self.pinned = set()
+        self.used = 0
+        self.atlas_over_budget = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, file, mode="alpha", size=None):
+        key = (file, mode, size)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surf
+
+        self.misses += 1
+        surf = self.load(file, mode, size)
+        self.store(key, surf)
+        return surf
+
+    def put(self, file, mode="alpha", size=None, decoded=None):
+        # Finishes a file decoded elsewhere, conversion has to happen on the main thread
+        key = (file, mode, size)
+        surf = self.surfaces.get(key)
+        if surf is None:
+            self.misses += 1
+            surf = self.load(file, mode, size, decoded)
+            self.store(key, surf)
+        return surf
+
+    def load(self, file, mode, size, decoded=None):
+        img = pack.lookup(file, mode, size)
+        if img is not None:
+            return img
+        img = atlas.lookup(file)
+        if img is not None:
+            if mode != "alpha":
+                img = img.convert()
+        else:
+            img = decoded if decoded is not None else image.load(file)
+            if mode == "alpha":
+                img = img.convert_alpha()
+            else:
+                img = img.convert()
+        if size is not None:
+            img = transform.scale(img, size)
+        return img
+
+    def store(self, key, surf):
+        nbytes = surface_bytes(surf)
+        self.surfaces[key] = surf
+        self.sizes[key] = nbytes
+        self.used += nbytes
+        self.evict()
+
+    def pin(self, keys):
+        self.pinned.update(keys)
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.evict()
+
+    def evict(self):
+        # The atlas pages cannot be dropped, so only what is left of the budget after them is enforced.
+        # An atlas over the whole budget is reported rather than emptying the cache on every store.
+        limit = self.budget - atlas.bytes()
+        self.atlas_over_budget = limit < 0
+        if self.used <= limit or self.atlas_over_budget:
+            return
+        # The newest surface always stays, even when it alone is over budget
+        for key in list(self.surfaces)[:-1]:
+            if self.used <= limit:
+                break
+            if key in self.pinned:
+                continue
+            del self.surfaces[key]
+            self.used -= self.sizes.pop(key)
+            self.evictions += 1
+
+    def report(self):
+        return sorted(self.sizes.items(), key=lambda item: item[1], reverse=True)
+
+    def stats(self):
+        return {"surfaces": len(self.surfaces), "bytes": self.used, "budget": self.budget,
+                "atlas_bytes": atlas.bytes(), "atlas_over_budget": self.atlas_over_budget,
+                "pinned": len(self.pinned), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class TransformCache(lru.IdentityLRU):
+    # Rotated and scaled copies keyed by (source surface, operation, parameters)
+    def __init__(self, limit=1024):
+        lru.IdentityLRU.__init__(self, limit)
+
+    def rotate(self, surface, angle, step=1):
+        angle = round(angle / step) * step % 360
+        if angle == 0:
+            return surface
+        return self.lookup(surface, ("rotate", angle), transform.rotate, surface, angle)
+
+    def scale(self, surface, size):
+        size = (int(size[0]), int(size[1]))
+        return self.lookup(surface, ("scale", size), transform.scale, surface, size)
+
+    def scale2x(self, surface):
+        return self.lookup(surface, ("scale2x", None), transform.scale2x, surface)
+
+    def stats(self):
+        return {"surfaces": len(self), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+
+class TextCache:
+    # Rendered strings keyed by (font, text, antialias, color)
+    def __init__(self, limit=256):
+        self.limit = limit
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, antialias, color):
+        key = (font, text, antialias, tuple(color))
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surf
+
+        self.misses += 1
+        surf = font.render(text, antialias, color)
+        self.surfaces[key] = surf
+        while len(self.surfaces) > self.limit:
+            self.surfaces.popitem(last=False)
+        return surf
+
+    def stats(self):
+        return {"surfaces": len(self.surfaces), "hits": self.hits, "misses": self.misses}
+
+
+class Counter:
+    # A label and a number built from pre-rendered digit glyphs, recomposed only when the number changes
+    def __init__(self, font, label, color, antialias=True):
+        self.label = text_cache.render(font, label, antialias, color)
+        self.digits = [text_cache.render(font, str(digit), antialias, color) for digit in range(10)]
+        self.value = None
+        self.surface = None
+
+    def render(self, value):
+        if value == self.value:
+            return self.surface
+
+        glyphs = [self.label] + [self.digits[int(digit)] for digit in str(int(value))]
+        width = sum(glyph.get_width() for glyph in glyphs)
+        height = max(glyph.get_height() for glyph in glyphs)
+        surf = Surface((width, height), SRCALPHA, 32)
+        x = 0
+        for glyph in glyphs:
+            # Glyphs never overlap, so RGBA_MAX onto the clear surface copies them as they are
+            surf.blit(glyph, (x, 0), special_flags=BLEND_RGBA_MAX)
+            x += glyph.get_width()
+        self.value = value
+        self.surface = surf
+        return surf
+
+
+class AssetLoader:
+    # Decodes image files on a worker thread, pygame lets go of the GIL while it decodes.
+    # Converting needs the display, so pump finishes the decoded files on the main thread between frames.
+    def __init__(self, cache):
+        self.cache = cache
+        self.jobs = []
+        self.queued = []
+        self.posted = 0
+        self.decoded = deque()
+        self.thread = None
+        self.total = 0
+        self.done = 0
+        self.started = None
+        self.finished = None
+        self.decode_seconds = 0.0
+        self.convert_seconds = 0.0
+
+    def add(self, file, mode="alpha", size=None):
+        job = (file, mode, size)
+        if job not in self.jobs and job not in self.cache.surfaces:
+            self.jobs.append(job)
+
+    def start(self):
+        if not pack.opened:
+            pack.open()
+        if not atlas.read_index:
+            atlas.read()
+        jobs = list(self.jobs)
+        if not atlas.loaded and atlas.page_files and not all(pack.covers(*job) for job in jobs):
+            jobs.insert(0, ("atlas", None, None))
+            atlas.pending = True
+        self.jobs = []
+        self.queued = jobs
+        self.posted = 0
+        self.total = len(jobs)
+        self.done = 0
+        self.started = perf_counter()
+        self.finished = None
+
+        def decode():
+            for job in jobs:
+                start = perf_counter()
+                try:
+                    if job[0] == "atlas":
+                        result = [image.load(page) for page in atlas.page_files]
+                    elif pack.covers(*job) or atlas.covers(job[0]):
+                        result = None
+                    else:
+                        result = image.load(job[0])
+                except Exception:
+                    # Left for the main thread, which loads it again and raises there
+                    result = None
+                self.decode_seconds += perf_counter() - start
+                self.decoded.append((job, result))
+                self.posted += 1
+
+        self.thread = threading.Thread(target=decode, name="asset-loader")
+        self.thread.daemon = True
+        self.thread.start()
+        return self.total
+
+    def pump(self, budget_ms=4.0):
+        # Converts decoded files until the budget for this frame runs out
+        start = perf_counter()
+        while self.decoded and perf_counter() - start < budget_ms / 1000.0:
+            job, result = self.decoded.popleft()
+            if job[0] == "atlas":
+                atlas.load(result)
+            else:
+                self.cache.put(job[0], job[1], job[2], result)
+            self.done += 1
+        self.convert_seconds += perf_counter() - start
+        if self.finished is None and self.done == self.total:
+            self.finished = perf_counter()
+        return self.progress()
+
+    def progress(self):
+        return self.done / float(self.total) if self.total else 1.0
+
+    def ready(self):
+        return self.done == self.total
+
+    def wait(self):
+        while not self.ready():
+            if not self.decoded:
+                self.thread.join(0.001)
+                if not self.thread.is_alive() and not self.decoded:
+                    # The worker stopped early, whatever it never handed over loads here instead
+                    self.decoded.extend((job, None) for job in self.queued[self.posted:])
+                    self.posted = len(self.queued)
+            self.pump(1000.0)
+
+    def stats(self):
+        elapsed = (self.finished or perf_counter()) - self.started if self.started else 0.0
+        return {"total": self.total, "done": self.done, "progress": round(self.progress(), 3),
+                "seconds": round(elapsed, 3), "decode_seconds": round(self.decode_seconds, 3),
+                "convert_seconds": round(self.convert_seconds, 3)}
+
+
+def surface_bytes(surf):
+    # Subsurfaces share their parent's pixels
+    if surf.get_parent() is not None:
+        return 0
+    return surf.get_pitch() * surf.get_height()
+
+
+pack = AssetPack()
+atlas = Atlas()
+cache = SurfaceCache()
+loader = AssetLoader(cache)
+transforms = TransformCache()
+text_cache = TextCache()
+
+
+def rotate(surface, angle, step=1):
+    return transforms.rotate(surface, angle, step)
+
+
+def scale(surface, size):
+    return transforms.scale(surface, size)
+
+
+def scale2x(surface):
+    return transforms.scale2x(surface)
+
+
+def render_text(font, text, antialias, color):
+    return text_cache.render(font, text, antialias, color)
+
+
 def load_image(file):
-    img = image.load(path.join("graphics", file)).convert_alpha()
-    return img
-
-
-# Image Library
-img_background = image.load(path.join("graphics", "background.bmp")).convert()
-img_bullet = image.load(path.join("graphics", "bullet.png")).convert_alpha()
-img_bullet_2 = image.load(path.join("graphics", "bullet_2.png")).convert_alpha()
-img_bullet_3 = image.load(path.join("graphics", "bullet_3.png")).convert_alpha()
-img_missile = image.load(path.join("graphics", "missile.png")).convert_alpha()
-img_explosion = image.load(path.join("graphics", "explosion.png")).convert_alpha()
-img_explosion_final = image.load(path.join("graphics", "explosion_last.png")).convert_alpha()
-img_player = image.load(path.join("graphics", "ship.png")).convert_alpha()
-img_player_forward = image.load(path.join("graphics", "ship_moveforward.png")).convert_alpha()
-img_player_back = image.load(path.join("graphics", "ship_moveback.png")).convert_alpha()
-img_player_left = image.load(path.join("graphics", "ship_moveleft.png")).convert_alpha()
-img_player_right = image.load(path.join("graphics", "ship_moveright.png")).convert_alpha()
-img_player_invulnerable = image.load(path.join("graphics", "ship_invulnerable.png")).convert_alpha()
-img_fighter = image.load(path.join("graphics", "fighter.png")).convert_alpha()
-img_fighter_hit = image.load(path.join("graphics", "fighter_hit.png")).convert_alpha()
-img_frigate = image.load(path.join("graphics", "frigate.png")).convert_alpha()
-img_frigate_hit = image.load(path.join("graphics", "frigate_hit.png")).convert_alpha()
-img_cruiser = image.load(path.join("graphics", "cruiser.png")).convert_alpha()
-img_cruiser_firing = image.load(path.join("graphics", "cruiser_firing.png")).convert_alpha()
-img_cruiser_hit = image.load(path.join("graphics", "cruiser_hit.png")).convert_alpha()
-img_beam = image.load(path.join("graphics", "beam.png")).convert()
-img_beam_arc = image.load(path.join("graphics", "beam_arc.png")).convert()
-img_life = image.load(path.join("graphics", "life.png")).convert_alpha()
-img_hit = image.load(path.join("graphics", "hit.png")).convert_alpha()
-img_title_stars = image.load(path.join("graphics", "title_stars.png")).convert()
-img_title_background = image.load(path.join("graphics", "title_background.png")).convert()
-img_title_background = transform.scale(img_title_background, (constants.SCREEN_WIDTH, constants.SCREEN_HEIGHT))
-img_title_a = image.load(path.join("graphics", "title_a.png")).convert_alpha()
-img_title_b = image.load(path.join("graphics", "title_b.png")).convert_alpha()
-img_title_whole = image.load(path.join("graphics", "title_whole.png")).convert_alpha()
-img_enemy_shot_a = image.load(path.join("graphics", "enemy_shot_a.png")).convert_alpha()
-img_enemy_shot_b = image.load(path.join("graphics", "enemy_shot_b.png")).convert_alpha()
-
-scanlines = image.load(path.join("scanlines.png")).convert_alpha()
-scanlines = transform.scale(scanlines, (constants.SCREEN_WIDTH, constants.SCREEN_HEIGHT))
-
-title_ship_a = image.load(path.join("graphics", "TITLE_SHIP", "zx_delta_1.png")).convert_alpha()
-title_ship_b = image.load(path.join("graphics", "TITLE_SHIP", "zx_delta_2.png")).convert_alpha()
-
-
-def explosion(x, y):
-    for file in glob("graphics/explosion_1/*.png"):
-        img = image.load(file).convert_alpha()
-        img = transform.scale(img, (200, 200))
-        for _ in range(10):
-            screen.blit(img, (x - 80, y - 80))
-            display.update()
+    return cache.get(path.join("graphics", file))
+
+
+# Image Library, loaded on first use through the cache
+IMAGES = {
+    "img_background": (path.join("graphics", "background.bmp"), "opaque", None),
+    "img_bullet": (path.join("graphics", "bullet.png"), "alpha", None),
+    "img_bullet_2": (path.join("graphics", "bullet_2.png"), "alpha", None),
+    "img_bullet_3": (path.join("graphics", "bullet_3.png"), "alpha", None),
+    "img_missile": (path.join("graphics", "missile.png"), "alpha", None),
+    "img_explosion": (path.join("graphics", "explosion.png"), "alpha", None),
+    "img_explosion_final": (path.join("graphics", "explosion_last.png"), "alpha", None),
+    "img_player": (path.join("graphics", "ship.png"), "alpha", None),
+    "img_player_forward": (path.join("graphics", "ship_moveforward.png"), "alpha", None),
+    "img_player_back": (path.join("graphics", "ship_moveback.png"), "alpha", None),
+    "img_player_left": (path.join("graphics", "ship_moveleft.png"), "alpha", None),
+    "img_player_right": (path.join("graphics", "ship_moveright.png"), "alpha", None),
+    "img_player_invulnerable": (path.join("graphics", "ship_invulnerable.png"), "alpha", None),
+    "img_fighter": (path.join("graphics", "fighter.png"), "alpha", None),
+    "img_fighter_hit": (path.join("graphics", "fighter_hit.png"), "alpha", None),
+    "img_frigate": (path.join("graphics", "frigate.png"), "alpha", None),
+    "img_frigate_hit": (path.join("graphics", "frigate_hit.png"), "alpha", None),
+    "img_cruiser": (path.join("graphics", "cruiser.png"), "alpha", None),
+    "img_cruiser_firing": (path.join("graphics", "cruiser_firing.png"), "alpha", None),
+    "img_cruiser_hit": (path.join("graphics", "cruiser_hit.png"), "alpha", None),
+    "img_beam": (path.join("graphics", "beam.png"), "opaque", None),
+    "img_beam_arc": (path.join("graphics", "beam_arc.png"), "opaque", None),
+    "img_life": (path.join("graphics", "life.png"), "alpha", None),
+    "img_hit": (path.join("graphics", "hit.png"), "alpha", None),
+    "img_title_stars": (path.join("graphics", "title_stars.png"), "opaque", None),
+    "img_title_background": (path.join("graphics", "title_background.png"), "opaque",
+                             (constants.SCREEN_WIDTH, constants.SCREEN_HEIGHT)),
+    "img_title_a": (path.join("graphics", "title_a.png"), "alpha", None),
+    "img_title_b": (path.join("graphics", "title_b.png"), "alpha", None),
+    "img_title_whole": (path.join("graphics", "title_whole.png"), "alpha", None),
+    "img_enemy_shot_a": (path.join("graphics", "enemy_shot_a.png"), "alpha", None),
+    "img_enemy_shot_b": (path.join("graphics", "enemy_shot_b.png"), "alpha", None),
+    "scanlines": ("scanlines.png", "alpha", (constants.SCREEN_WIDTH, constants.SCREEN_HEIGHT)),
+}
+
+cache.pin(IMAGES.values())
+
+
+def preload():
+    # Everything the game draws, loaded up front so gameplay never decodes an image
+    if not atlas.loaded:
+        atlas.load()
+    for name in IMAGES:
+        cache.get(*IMAGES[name])
+    return cache.stats()
+
+
+def queue_preload():
+    # The same set for the background loader, started with loader.start()
+    for name in IMAGES:
+        loader.add(*IMAGES[name])
+
+
+def __getattr__(name):
+    if name in IMAGES:
+        return cache.get(*IMAGES[name])
+    raise AttributeError("module 'gfx' has no attribute " + repr(name))
+
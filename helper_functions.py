@@ -1,24 +1,22 @@
 from random import choice
-from math import atan2
 import gfx
 
+# Milliseconds of simulated game time, advanced by every update step
+game_time = 0
 
-def scanlines():
-    return gfx.screen.blit(gfx.scanlines, (0, 0))
 
-
-def randomize(scale):
-    return choice([-scale, 0, scale])
+def ticks():
+    return game_time
 
 
-def calc_angle(origin, target):
+def advance_ticks(ms):
+    global game_time
+    game_time += ms
 
-    x = origin.rect.x
-    y = origin.rect.y
 
-    x2 = target.rect.x
-    y2 = target.rect.y
+def scanlines(rects=None):
+    return gfx.scanline_filter.apply(rects)
 
-    angle = atan2(y2 - y, x2 - x)
 
-    return angle
\ No newline at end of file
+def randomize(scale):
+    return choice([-scale, 0, scale])
@@ -0,0 +1,31 @@
+from collections import OrderedDict
+
+
+class IdentityLRU:
+    # Values keyed by an object's identity plus a key of their own, least recently used dropped first.
+    # The object is kept with its value so its id cannot be reused while the entry is cached.
+    def __init__(self, limit):
+        self.limit = limit
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, obj, key, make, *args):
+        key = (id(obj), key)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is obj:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        value = make(*args)
+        self.entries[key] = (obj, value)
+        while len(self.entries) > self.limit:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return value
@@ -1,16 +1,24 @@
-from math import sin, cos, degrees
+from math import sin, cos
 from os import path, environ
-from random import choice, randrange, randint
-from sys import exit
+from random import choice, randrange, randint, seed
+from sys import argv, exit
+from time import perf_counter
 
+import numpy as np
 import pygame as pg
 
+import anim
+import collision
+import entities
 import gfx
 import helper_functions
 import player
+import profiler
+import projectiles
 import snd
+import squadrons
 from chroma import BLACK, WHITE
-from constants import SCREEN_WIDTH, SCREEN_HEIGHT, FONT_SIZE
+from constants import SCREEN_WIDTH, SCREEN_HEIGHT, FONT_SIZE, MIXER_CHANNELS, DIRTY_RECTS, PROJECTILE_CAPACITY
 
 # Macros
 SCREEN_CENTER = (SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2)
@@ -19,82 +27,81 @@ SCREEN_CENTER = (SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2)
 class Stars(pg.sprite.Sprite):
     MAX_STARS = 100
     color = (0, 0, 0)
-
+    colors = [(100, 100, 100), (190, 190, 190), (255, 255, 255)]
+
+    def __init__(self, count=MAX_STARS):
+        width, height = gfx.screen.get_size()
+        self.count = count
+        self.x = np.random.randint(0, width - 1, count)
+        self.y = np.random.randint(0, height - 1, count)
+        # Size doubles as speed, 1 to 3 pixels per step
+        self.size = np.random.randint(1, 4, count)
+        self.moved = np.zeros(count, dtype=int)
+
+    def update(self, speed=1):
+        self.moved = self.size * speed
+        self.y += self.moved
+        wrapped = self.y >= gfx.screen.get_height()
+        respawned = np.count_nonzero(wrapped)
+        if respawned:
+            self.y[wrapped] = 0
+            self.x[wrapped] = np.random.randint(0, SCREEN_WIDTH, respawned)
+            self.size[wrapped] = np.random.randint(1, 4, respawned)
+            self.moved[wrapped] = 0
+
+    def streaks(self, alpha):
+        # At speed n a star covers n of its own sizes in a step, drawn as one streak
+        streak = np.maximum(self.moved, self.size)
+        top = (self.y - (1 - alpha) * self.moved).astype(int) - streak + self.size
+        return top, streak
+
+    def rects(self, alpha=1.0):
+        top, streak = self.streaks(alpha)
+        return zip(self.x.tolist(), top.tolist(), self.size.tolist(), streak.tolist())
+
+    def render(self, alpha=1.0):
+        width, height = gfx.screen.get_size()
+        top, streak = self.streaks(alpha)
+
+        # Every pixel of every streak at once, masked down to the ones that exist
+        dx = np.arange(3)[None, :, None]
+        dy = np.arange(streak.max())[None, None, :]
+        shape = (self.count, 3, len(dy[0, 0]))
+        xs = np.broadcast_to(self.x[:, None, None] + dx, shape)
+        ys = np.broadcast_to(top[:, None, None] + dy, shape)
+        keep = (dx < self.size[:, None, None]) & (dy < streak[:, None, None])
+        keep &= (xs < width) & (ys >= 0) & (ys < height)
+        mapped = np.array([gfx.screen.map_rgb(color) for color in self.colors], dtype=np.uint32)
+        colors = np.broadcast_to(mapped[self.size - 1][:, None, None], shape)
+
+        try:
+            pixels = pg.surfarray.pixels2d(gfx.screen)
+        except ValueError:
+            # 24 bit displays cannot be viewed as a 2d array
+            for x, y, size, h in zip(self.x, top, self.size, streak):
+                gfx.screen.fill(self.colors[size - 1], (x, y, size, h))
+            return
+        pixels[xs[keep], ys[keep]] = colors[keep]
+        del pixels
+
+
+# Plain enemy shots run in bulk, kinds are registered once the images are loaded
+shots = projectiles.Projectiles(PROJECTILE_CAPACITY, (0, 0, SCREEN_WIDTH, SCREEN_HEIGHT))
+FIGHTER_SHOT = 0
+CRUISER_SHOT = 1
+
+
+class PowerUp(collision.MaskedSprite):
     def __init__(self):
-        self.stars = []
-        for i in range(self.MAX_STARS):
-            star = [randrange(0, gfx.screen.get_width() - 1),
-                    randrange(0, gfx.screen.get_height() - 1),
-                    choice([1, 2, 3])]
-            self.stars.append(star)
-
-    def render(self):
-        for star in self.stars:
-            star[1] += star[2]
-            if star[1] >= gfx.screen.get_height():
-                star[1] = 0
-                star[0] = randrange(0, SCREEN_WIDTH)
-                star[2] = choice([1, 2, 3])
-
-            if star[2] == 1:
-                self.color = (100, 100, 100)
-            elif star[2] == 2:
-                self.color = (190, 190, 190)
-            elif star[2] == 3:
-                self.color = (255, 255, 255)
-
-            gfx.screen.fill(self.color, (star[0], star[1], star[2], star[2]))
-
-
-class Bullet(pg.sprite.Sprite):
-    def __init__(self, x, y, image):
         pg.sprite.Sprite.__init__(self)
-
-        self.image = image
-        self.rect = self.image.get_rect()
-        self.rect.center = (x, y)
-        self.size = (self.rect.x, self.rect.y)
-        self.dx = 0
-        self.dy = 0
-
-    def update(self):
-        x, y = self.rect.center
-        x += self.dx
-        y += self.dy
-        self.rect.center = x, y
-
-        if y <= 0:
-            self.kill()
-
-    def on_hit(self):
-        s = gfx.screen.blit(gfx.img_hit, (self.rect.centerx - gfx.img_hit.get_width() / 2, self.rect.y))
-        pg.display.update(s)
-
-
-class PowerUp(pg.sprite.Sprite):
-    def __init__(self):
-        pg.sprite.Sprite.__init__(self)
-        self.images = []
-        self.images.append(gfx.load_image("POWERUP/powerup_a.png"))
-        self.images.append(gfx.load_image("POWERUP/powerup_b.png"))
-        self.images.append(gfx.load_image("POWERUP/powerup_c.png"))
-        self.next_anim_frame = 0
-        self.index = 0
-        self.image = self.images[self.index]
+        self.playhead = anim.Playhead("powerup")
+        self.image = self.playhead.image
         self.rect = pg.Rect(0, 0, 40, 40)
         self.rect.x = randrange(40, SCREEN_WIDTH - 40)
         self.rect.y = 1
 
     def update(self):
-        self.next_anim_frame += 1
-        if self.next_anim_frame >= 10:
-            self.index += 1
-            self.next_anim_frame = 0
-            if self.index >= len(self.images):
-                self.index = 0
-
-            self.image = self.images[self.index]
-
+        self.image = self.playhead.advance()
         self.rect.y += 2
 
     def on_pickup(self):
@@ -102,12 +109,13 @@ class PowerUp(pg.sprite.Sprite):
         self.kill()
 
 
-class EnemyFighter(pg.sprite.Sprite):
+class EnemyFighter(collision.MaskedSprite):
     image = None
     HEALTH = 2
     BULLETS_MAX = 1
-    allBullets = pg.sprite.Group()
     spawn_areas = [50, 100, 200, 300, 400, 500, 600, 700, 750]
+    # Movement and aiming for every fighter run together in the squadron
+    squadron = squadrons.FighterSquadron(bounds=(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT))
 
     def __init__(self):
         pg.sprite.Sprite.__init__(self)
@@ -115,91 +123,59 @@ class EnemyFighter(pg.sprite.Sprite):
         self.rect = self.image.get_rect()
         self.rect.x = choice(self.spawn_areas)
         self.rect.y = 0
-        self.dx = 0
-        self.dy = 3
-        self.spawn_time = pg.time.get_ticks()
-        self.bullets = pg.sprite.Group()
-        self.has_shot = False
+        self.spawn_time = helper_functions.ticks()
         self.is_hit = False
-        self.change = 0
-        self.angle = 0
-
-    def movement(self):
-        if self.rect.bottom > 300:
-            self.dy = 2
-
-        if self.rect.left <= 0 or self.rect.right >= SCREEN_WIDTH:
-            self.kill()
-
-        if self.has_shot:
-            self.dy = 4
-            if self.rect.centerx > SCREEN_WIDTH / 2:
-                self.change += .1
-            else:
-                self.change -= .1
-
-        self.rect.x += self.dx + self.change
-        self.rect.y += self.dy
-
-        self.angle += degrees(self.change) / 180
+        self.slot = self.squadron.attach(self, 0, 3)
 
     def update(self):
         if self.is_hit:
             self.image = gfx.img_fighter_hit
-            pg.display.update(self.rect)
             self.is_hit = False
         else:
             self.image = gfx.img_fighter
 
-        if self.rect.y >= SCREEN_HEIGHT:
-            self.kill()
-        else:
-            self.movement()
-
+        angle = self.squadron.angle[self.slot]
         if self.HEALTH <= 0:
             self.die()
 
-        for bullet in self.allBullets:
-            bullet.image = choice([gfx.img_enemy_shot_a, gfx.img_enemy_shot_b])
+        self.image = gfx.rotate(self.image, angle)
 
-        self.image = pg.transform.rotate(self.image, self.angle)
-
-    def shoot(self, target):
+    def shoot(self, angle):
         for bullet in range(self.BULLETS_MAX):
-            new_bullet = Bullet(self.rect.centerx, self.rect.bottom, gfx.img_enemy_shot_a)
-            new_bullet.dx = 5 * cos(helper_functions.calc_angle(self, target))
-            new_bullet.dy = 5 * sin(helper_functions.calc_angle(self, target))
-            self.allBullets.add(new_bullet)
+            shots.spawn(self.rect.centerx, self.rect.bottom, 5 * cos(angle), 5 * sin(angle), FIGHTER_SHOT)
             snd.load_sound("enemy_shoot.wav")
-        self.has_shot = True
+
+    def kill(self):
+        if self.slot is not None:
+            self.squadron.release(self.slot)
+            self.slot = None
+        pg.sprite.Sprite.kill(self)
 
     def die(self):
         snd.load_sound("explode.wav")
         self.image = gfx.img_explosion
-        s = gfx.screen.blit(self.image, (self.rect.x - 40, self.rect.y - 40))
-        pg.display.update(s)
+        gfx.effects.submit(self.image, (self.rect.x - 40, self.rect.y - 40), 4)
         self.kill()
 
 
-class EnemyFrigate(pg.sprite.Sprite):
+class EnemyFrigate(collision.MaskedSprite):
     image = None
     HEALTH = 50
     MAX_SHOTS = 3
 
-    allBullets = pg.sprite.Group()
+    allBullets = entities.registry.group("missiles")
+    squadron = squadrons.FrigateSquadron(4, (0, 0, SCREEN_WIDTH, SCREEN_HEIGHT))
 
-    def __init__(self):
+    def __init__(self, y=0):
         pg.sprite.Sprite.__init__(self)
         self.spawn_delay = 0
         self.image = gfx.img_frigate
         self.rect = self.image.get_rect()
         self.size = self.image.get_size()
-        self.rect.x = 0
         self.rect.right = 0
-        self.rect.bottom = 0
-        self.dx = 1
-        self.dy = 0
+        self.rect.y = y
         self.is_hit = False
+        self.slot = self.squadron.attach(self, 1, 0)
 
     def update(self):
         if self.is_hit:
@@ -210,27 +186,29 @@ class EnemyFrigate(pg.sprite.Sprite):
         else:
             self.image = gfx.img_frigate
 
-        self.rect.x += self.dx
-
     def shoot(self):
-        missile = Bullet(self.rect.centerx, self.rect.bottom, gfx.img_missile)
-        missile.image = pg.transform.rotate(missile.image, 180)
-        missile.dy = 4
-        self.allBullets.add(missile)
+        missile = entities.bullets.acquire(self.rect.centerx, self.rect.bottom,
+                                           gfx.rotate(gfx.img_missile, 180), 0, 4)
+        entities.registry.spawn(missile, "missiles", "enemy_bullets")
 
     def die(self):
         snd.load_sound("explode.wav")
-        self.image = gfx.img_explosion_final
-        self.image = pg.transform.scale(self.image, (300, 300))
-        s = gfx.screen.blit(self.image, (self.rect.x - 50, self.rect.y - 120))
-        pg.display.update(s)
+        self.image = gfx.scale(gfx.img_explosion_final, (300, 300))
+        gfx.effects.submit(self.image, (self.rect.x - 50, self.rect.y - 120), 6)
         self.kill()
 
+    def kill(self):
+        if self.slot is not None:
+            self.squadron.release(self.slot)
+            self.slot = None
+        pg.sprite.Sprite.kill(self)
+
 
-class EnemyCruiser(pg.sprite.Sprite):
+class EnemyCruiser(collision.MaskedSprite):
     image = None
     HEALTH = 1000
-    allBullets = pg.sprite.Group()
+    allBullets = entities.registry.group("beams")
+    health_bar_rect = pg.Rect(SCREEN_WIDTH - 50, 40, 20, 500)
 
     def __init__(self):
         pg.sprite.Sprite.__init__(self)
@@ -348,32 +326,27 @@ class EnemyCruiser(pg.sprite.Sprite):
 
     def fire_beam(self):
 
-        beam = Bullet(self.rect.centerx, self.rect.bottom - 60, gfx.img_beam)
-        beam.dy = 8
-        self.allBullets.add(beam)
+        beam = entities.bullets.acquire(self.rect.centerx, self.rect.bottom - 60, gfx.img_beam, 0, 8)
+        entities.registry.spawn(beam, "beams", "enemy_bullets")
         snd.load_sound("firing_beam.wav")
-        s = gfx.screen.blit(gfx.img_beam_arc,
-                            (self.rect.centerx - (gfx.img_beam_arc.get_width() / 2), self.rect.bottom - 100))
-        pg.display.update(s)
+        # Lasts until the next beam, so the arc stays lit while the cruiser fires
+        gfx.effects.submit(gfx.img_beam_arc,
+                           (self.rect.centerx - (gfx.img_beam_arc.get_width() / 2), self.rect.bottom - 100), 5)
         self.has_shot = True
 
     def fire_shots(self):
-        shot_left = Bullet(self.rect.left, self.rect.y + 100, gfx.img_enemy_shot_a)
-        shot_right = Bullet(self.rect.right, self.rect.y + 100, gfx.img_enemy_shot_a)
-        shot_left.dx = -1 * helper_functions.randomize(1)
-        shot_left.dy = 5
-        shot_right.dx = 1 * helper_functions.randomize(1)
-        shot_right.dy = 5
-        self.allBullets.add(shot_left, shot_right)
+        shots.spawn(self.rect.left, self.rect.y + 100, -1 * helper_functions.randomize(1), 5, CRUISER_SHOT)
+        shots.spawn(self.rect.right, self.rect.y + 100, 1 * helper_functions.randomize(1), 5, CRUISER_SHOT)
 
     def die(self):
+        # Each explosion starts two frames of the animation after the one before
+        stagger = anim.frames("explosion").steps[0] * 2
         for i in range(9):
-            pg.display.update(
-                    gfx.explosion(self.center[0] + randrange(-100, 100, 20), self.center[1] + randrange(-100, 100, 20)))
-            snd.load_sound("explode.wav")
-        self.image = pg.transform.scale2x(gfx.load_image("explosion_last.png"))
+            entities.Explosion(self.center[0] + randrange(-100, 100, 20), self.center[1] + randrange(-100, 100, 20),
+                               i * stagger, "explode.wav")
+        self.image = gfx.scale2x(gfx.img_explosion_final)
+        gfx.effects.submit(self.image, self.image.get_rect(center=self.rect.center).topleft, 10)
         snd.load_sound("blow_up.wav")
-        pg.display.update()
         snd.play_song("saturns_folly.ogg")
         self.kill()
 
@@ -394,24 +367,34 @@ class GameControl:
         self.screen = gfx.screen
         self._is_fullscreen = False
         self.font = None
+        self.score_counter = None
         self._is_running = True
         self.started = True
         self.boss_defeated = False
         self.start_time = 0
         self.gametime = 0
         self.FPS = 60
-        self.player = player.Player()
-        self.powerups = pg.sprite.Group()
+        self.RENDER_FPS = 144
+        self.MAX_STEPS = 5
+        # Created in on_loaded, its images may still be decoding until then
+        self.player = None
+        self.powerups = entities.registry.group("powerups")
         self.drop_chance = 5
         self.player_lives = 3
         self.dead_timer = 0
-        self.player_bullets = self.player.allBullets
-        self.fighters = pg.sprite.Group()
-        self.frigates = pg.sprite.Group()
-        self.cruiser = pg.sprite.Group()
-        self.enemies = pg.sprite.Group()
-        self.enemy_bullets = pg.sprite.Group()
-        self.all_sprites = pg.sprite.Group()
+        self.player_bullets = None
+        self.fighters = entities.registry.group("fighters")
+        self.frigates = entities.registry.group("frigates")
+        self.cruiser = entities.registry.group("cruiser")
+        self.enemies = entities.registry.group("enemies")
+        self.enemy_bullets = entities.registry.group("enemy_bullets")
+        self.all_sprites = entities.registry.all
+        self.enemy_grid = collision.SpatialHash()
+        self.collision_tests = (0, 0)
+        self.dirty_fraction = 1.0
+        self.live_entities = 0
+        self.profiler = profiler.from_environ()
+        self.overlay_font = None
         self.star_speed = 1
         self.counter = 0
         self.ticker = 0
@@ -420,22 +403,52 @@ class GameControl:
 
     def on_init(self):
         environ["SDL_VIDEO_CENTERED"] = "1"
-        pg.mixer.pre_init(44100, -16, 4, 512)
+        if not gfx.headless:
+            pg.mixer.pre_init(44100, -16, 4, 512)
         pg.init()
         pg.display.init()
-        pg.mixer.init()
+        if gfx.headless:
+            pg.mixer.quit()
+            snd.enabled = False
+        else:
+            pg.mixer.init()
+            snd.set_channels(MIXER_CHANNELS)
+            snd.preload_sounds()
+            snd.prefetch_music()
         pg.font.init()
 
         self.font = pg.font.Font(path.join("fonts", "spacebit.ttf"), FONT_SIZE)
+        self.score_counter = gfx.Counter(self.font, "ENEMIES KILLED: ", WHITE)
+        # Images decode in the background while the title screen plays, see on_loaded
+        gfx.queue_preload()
+        anim.queue_preload()
+        gfx.loader.start()
         self.clock = pg.time.Clock()
+        if self.profiler.enabled:
+            self.overlay_font = pg.font.Font(None, 20)
 
         self.stars = Stars()
+        if DIRTY_RECTS and not gfx.headless:
+            gfx.dirty = gfx.DirtyRects()
+
+    def on_loaded(self):
+        # Gameplay starts here, once every image it draws is in the cache
+        gfx.loader.wait()
+        anim.preload()
+        if self.player is None:
+            self.player = player.Player()
+            self.player_bullets = self.player.allBullets
+            entities.registry.spawn(self.player, "player")
+        entities.bullets.fill(gfx.img_bullet)
+        if not shots.frames:
+            shots.add_kind([gfx.img_enemy_shot_a, gfx.img_enemy_shot_b])
+            shots.add_kind([gfx.img_enemy_shot_a])
+        return gfx.loader.stats()
 
     def on_event(self):
         for e in pg.event.get():
             if e.type == pg.QUIT:
-                pg.quit()
-                exit()
+                self.on_cleanup()
             if e.type == pg.KEYDOWN:
                 if e.key == pg.K_ESCAPE:
                     self._is_running = False
@@ -443,9 +456,13 @@ class GameControl:
                     if not self._is_fullscreen:
                         pg.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pg.FULLSCREEN)
                         self._is_fullscreen = True
+                        gfx.invalidate()
                     elif self._is_fullscreen:
                         pg.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
                         self._is_fullscreen = False
+                        gfx.invalidate()
+                if e.key == pg.K_F3 and self.profiler.enabled:
+                    self.profiler.overlay = not self.profiler.overlay
 
         pressed = pg.key.get_pressed()
         if not self.player.dead:
@@ -469,18 +486,15 @@ class GameControl:
                 self.player.shoot()
 
     def update_loop(self):
+        prof = self.profiler
         # self.gametime = round(time() - self.start_time)
+        helper_functions.advance_ticks(1000.0 / self.FPS)
+        gfx.effects.step()
         self.ticker += 1
         if self.ticker == self.FPS:
             self.gametime += 1
             self.ticker = 0
 
-        self.all_sprites.add(self.player_bullets)
-        self.all_sprites.add(self.enemy_bullets)
-        self.all_sprites.add(self.player)
-        self.all_sprites.add(self.enemies)
-        self.all_sprites.add(self.powerups)
-
         if self.player_lives <= 0:
             self._is_running = False
 
@@ -488,53 +502,39 @@ class GameControl:
             if not self.boss_defeated and not self.player.dead:
                 if len(self.cruiser) < 1 and self.KILL_COUNT >= 99:
                     snd.play_song("deadly_opposition.ogg")
-                    big_enemy = EnemyCruiser()
-                    self.cruiser.add(big_enemy)
-                    self.enemies.add(self.cruiser)
+                    entities.registry.spawn(EnemyCruiser(), "cruiser", "enemies")
 
                 if len(self.fighters) < self.MAX_ENEMIES:
                     if len(self.cruiser) == 0:
                         self.spawn_timer += 1
                         if self.spawn_timer >= 20:
-                            little_enemy = EnemyFighter()
-                            self.fighters.add(little_enemy)
-                            self.enemies.add(self.fighters)
+                            entities.registry.spawn(EnemyFighter(), "fighters", "enemies")
                             self.spawn_timer = 0
 
                         if len(self.frigates) < 1:
-                            frigate = EnemyFrigate()
-                            frigate.rect.y = choice([50, 100, 150, 200, 250, 300])
-                            frigate.rect.right = 0
-                            self.frigates.add(frigate)
-                            self.enemies.add(self.frigates)
+                            frigate = EnemyFrigate(choice([50, 100, 150, 200, 250, 300]))
+                            entities.registry.spawn(frigate, "frigates", "enemies")
+            prof.lap("spawn")
 
             if self.ENEMIES_KILLED > 25:
                 self.MAX_ENEMIES += 1
                 self.ENEMIES_KILLED = 0
 
-            for fighter in self.fighters:
-                if not self.player.dead or self.player.arrive or self.player.respawn or self.player.invulnerable:
-                    if not fighter.has_shot:
-                        if abs(self.player.rect.y - fighter.rect.bottom <= 300) and abs(
-                                                self.player.rect.centerx - fighter.rect.centerx <= 500) and fighter.rect.y <= 900:
-                            fighter.shoot(self.player)
-                            self.enemy_bullets.add(fighter.allBullets)
-
-            for frigate in self.frigates:
-                if frigate.rect.left >= SCREEN_WIDTH:
-                    frigate.kill()
-                if frigate.rect.centerx == self.player.rect.centerx:
-                    frigate.shoot()
-                self.enemy_bullets.add(frigate.allBullets)
+            if not self.player.dead or self.player.arrive or self.player.respawn or self.player.invulnerable:
+                for fighter, angle in EnemyFighter.squadron.fire(self.player):
+                    fighter.shoot(angle)
+
+            for frigate in EnemyFrigate.squadron.fire(self.player):
+                frigate.shoot()
 
             for cruiser in self.cruiser:
-                print(cruiser.HEALTH)
                 if cruiser.HEALTH < 1:
-                    print("DEAD")
                     self.boss_defeated = True
                     cruiser.die()
                 if self.player.dead:
-                    cruiser.allBullets.empty()
+                    for bullet in cruiser.allBullets:
+                        bullet.kill()
+                    shots.clear(CRUISER_SHOT)
                 # if cruiser.rect.bottom <= self.player.rect.bottom:
                 #     new_bullet = Bullet(cruiser.rect.centerx, cruiser.rect.y, gfx.img_enemy_shot_a)
                 #     if self.player.rect.centerx < cruiser.rect.centerx:
@@ -543,14 +543,17 @@ class GameControl:
                 #     elif self.player.rect.centerx > cruiser.rect.centerx:
                 #         new_bullet.dx = 10
                 #         cruiser.allBullets.add(new_bullet)
-                self.enemy_bullets.add(cruiser.allBullets)
+
+            prof.lap("ai")
+
+            self.enemy_grid.rebuild(self.enemies)
+            prof.lap("grid")
 
             if not self.player.invulnerable:
-                for enemy in self.enemies:
-                    if pg.sprite.collide_mask(self.player, enemy):
-                        enemy.HEALTH -= 10
-                        self.player.die()
-                        self.player_lives -= 1
+                for enemy in self.enemy_grid.collide(self.player):
+                    enemy.HEALTH -= 10
+                    self.player.die()
+                    self.player_lives -= 1
 
                 for bullet in self.enemy_bullets:
                     if not self.player.dead and self.player.rect.colliderect(bullet.rect):
@@ -558,9 +561,16 @@ class GameControl:
                         bullet.kill()
                         self.player_lives -= 1
 
+                hits = shots.collide(self.player.rect)
+                if hits.size and not self.player.dead:
+                    self.player.die()
+                    shots.kill(hits[:1])
+                    self.player_lives -= 1
+                prof.lap("player_hits")
+
             for bullet in self.player_bullets:
-                for enemy in self.enemies:
-                    if enemy.HEALTH > 0 and enemy.rect.y >= 10 and pg.sprite.collide_mask(bullet, enemy):
+                for enemy in self.enemy_grid.query(bullet.rect):
+                    if enemy.HEALTH > 0 and enemy.rect.y >= 10 and self.enemy_grid.narrow(bullet, enemy):
                         bullet.on_hit()
                         snd.load_sound("hit.wav")
                         enemy.is_hit = True
@@ -570,31 +580,24 @@ class GameControl:
                         if enemy.HEALTH <= 0:
                             self.ENEMIES_KILLED += 1
                             self.KILL_COUNT += 1
-                            pwr_up = PowerUp()
-                            pwr_up.rect = enemy.rect
                             if randint(1, 20) == self.drop_chance:
-                                self.powerups.add(pwr_up)
+                                pwr_up = PowerUp()
+                                pwr_up.rect = enemy.rect.copy()
+                                entities.registry.spawn(pwr_up, "powerups")
+            prof.lap("bullet_hits")
 
             for beam in EnemyCruiser.allBullets:
-                for fighter in self.fighters:
-                    if pg.sprite.collide_mask(beam, fighter):
-                        fighter.die()
-                for frigate in self.frigates:
-                    if pg.sprite.collide_mask(beam, frigate):
-                        frigate.die()
+                for enemy in self.enemy_grid.query(beam.rect):
+                    if self.fighters.has(enemy) or self.frigates.has(enemy):
+                        if self.enemy_grid.narrow(beam, enemy):
+                            enemy.die()
+            prof.lap("beam_hits")
 
             for powerup in self.powerups:
                 if pg.sprite.collide_mask(powerup, self.player):
                     powerup.on_pickup()
                     self.player.power_level += 1
-
-            for sprite in self.all_sprites:
-                if 0 > sprite.rect.x > SCREEN_WIDTH:
-                    sprite.kill()
-                    self.all_sprites.remove(sprite)
-                if 0 > sprite.rect.y > SCREEN_HEIGHT:
-                    sprite.kill()
-                    self.all_sprites.remove(sprite)
+            prof.lap("pickups")
 
         # Mimic the apperance of hyper drive
         if self.player.arrive:
@@ -609,31 +612,86 @@ class GameControl:
 
         # Player ship leaves after boss defeated
         if self.boss_defeated:
-            self.enemy_bullets.empty()
+            for bullet in self.enemy_bullets:
+                bullet.kill()
+            shots.clear()
             self.star_speed = 5
             self.player.dx = 0
             self.player.move_up()
             if self.player.rect.bottom <= 0:
                 self._is_running = False
 
+        self.collision_tests = self.enemy_grid.frame_stats()
+        prof.lap("state")
+        EnemyFighter.squadron.step()
+        EnemyFrigate.squadron.step()
+        prof.lap("squadrons")
         self.all_sprites.update()
-        self.clock.tick(self.FPS)
-
-    def on_render(self):
-
-        # Background rendering
-        self.screen.blit(gfx.img_background, (0, 0))
-        for _ in range(self.star_speed):
-            self.stars.render()
-
-        # Display game info
-        score = self.font.render("ENEMIES KILLED: " + str(self.KILL_COUNT), True, WHITE)
+        prof.lap("sprites")
+        shots.step()
+        prof.lap("projectiles")
+        entities.registry.cull()
+        self.live_entities = entities.registry.live() + len(shots)
+        prof.lap("cull")
+        self.stars.update(self.star_speed)
+        prof.lap("stars")
+
+    def snapshot(self):
+        # Positions before a simulation step, for interpolating between steps
+        for sprite in self.all_sprites:
+            sprite.last_pos = sprite.rect.topleft
+
+    def interpolate(self, sprite, alpha):
+        x, y = sprite.rect.topleft
+        last_x, last_y = getattr(sprite, "last_pos", (x, y))
+        # Respawns and wrap-arounds jump, they should not slide across the screen
+        if abs(x - last_x) > 100 or abs(y - last_y) > 100:
+            return x, y
+        return round(last_x + (x - last_x) * alpha), round(last_y + (y - last_y) * alpha)
+
+    def on_render(self, alpha=1.0):
+        prof = self.profiler
+        sprites = [(sprite.image, self.interpolate(sprite, alpha)) for sprite in self.all_sprites]
+        score = self.score_counter.render(self.KILL_COUNT)
         lives = [(SCREEN_WIDTH - (gfx.img_life.get_width() + 10),
                   SCREEN_HEIGHT - gfx.img_life.get_height() - 20),
                  (SCREEN_WIDTH - (gfx.img_life.get_width() + 10) * 2,
                   SCREEN_HEIGHT - gfx.img_life.get_height() - 20), (
                      SCREEN_WIDTH - (gfx.img_life.get_width() + 10) * 3,
                      SCREEN_HEIGHT - gfx.img_life.get_height() - 20)]
+
+        overlay = prof.render_overlay(self.overlay_font)
+
+        # Work out what this frame touches before drawing any of it
+        regions = None
+        if gfx.dirty is not None:
+            for image, pos in sprites:
+                gfx.dirty.mark(image.get_rect(topleft=pos))
+            gfx.dirty.mark_all(self.stars.rects(alpha))
+            gfx.dirty.mark_all(shots.rects(alpha))
+            gfx.dirty.mark_all(gfx.effects.rects())
+            for i in range(self.player_lives):
+                gfx.dirty.mark(gfx.img_life.get_rect(topleft=lives[i]))
+            if self.cruiser:
+                gfx.dirty.mark(EnemyCruiser.health_bar_rect)
+            gfx.dirty.mark(score.get_rect(topleft=(20, SCREEN_HEIGHT - 50)))
+            if overlay is not None:
+                gfx.dirty.mark(overlay.get_rect(topleft=(10, 10)))
+            regions = gfx.dirty.regions()
+            self.dirty_fraction = gfx.dirty.fraction
+        prof.lap("prepare")
+
+        # Background rendering
+        if regions is None:
+            self.screen.blit(gfx.img_background, (0, 0))
+        else:
+            for rect in regions:
+                self.screen.blit(gfx.img_background, rect, rect)
+        prof.lap("background")
+        self.stars.render(alpha)
+        prof.lap("stars")
+
+        # Display game info
         for i in range(self.player_lives):
             self.screen.blit(gfx.img_life, lives[i])
 
@@ -645,15 +703,28 @@ class GameControl:
         if self.boss_defeated and self.player.rect.y < 100:
             i = 1 + i
             self.screen.fill((0,0,0,i))
+        prof.lap("hud")
 
-        # Render each sprite
-        self.all_sprites.draw(gfx.screen)
+        # Render each sprite between its last two simulated positions, with this frame's effects around them
+        gfx.effects.draw(self.screen, True)
+        self.screen.blits(sprites, False)
+        shots.draw(self.screen, alpha)
+        gfx.effects.draw(self.screen)
+        prof.lap("sprites")
 
         # Draw screen (with scanline)
-        helper_functions.scanlines()
-        pg.display.flip()
+        helper_functions.scanlines(regions)
+        prof.lap("scanlines")
+        if overlay is not None:
+            self.screen.blit(overlay, (10, 10))
+        if regions is None:
+            pg.display.flip()
+        else:
+            pg.display.update(regions)
+        prof.lap("present")
 
     def on_cleanup(self):
+        self.profiler.export()
         pg.quit()
         quit()
         exit()
@@ -685,10 +756,57 @@ class GameControl:
 
             self.screen.fill(color, (star[0], star[1], star[2], star[2]))
 
+    def autopilot(self):
+        # Stands in for the keyboard in headless runs: chase the nearest enemy ahead and keep firing
+        if self.player.dead:
+            return
+        ahead = [enemy for enemy in self.enemies if enemy.rect.bottom < self.player.rect.top]
+        if ahead:
+            target = min(ahead, key=lambda enemy: abs(enemy.rect.centerx - self.player.rect.centerx))
+            if target.rect.centerx < self.player.rect.centerx - 10:
+                self.player.move_left()
+            elif target.rect.centerx > self.player.rect.centerx + 10:
+                self.player.move_right()
+        self.player.shoot()
+
+    def run_headless(self, frames, random_seed=None, endless=True):
+        # Advances the world as fast as possible, with no rendering, audio or frame cap
+        if random_seed is not None:
+            seed(random_seed)
+            np.random.seed(random_seed)
+        self.on_loaded()
+        prof = self.profiler
+        start = perf_counter()
+        ran = 0
+        while ran < frames and self._is_running:
+            prof.begin_frame()
+            if endless:
+                self.player_lives = 3
+            prof.begin("event")
+            self.on_event()
+            self.autopilot()
+            prof.end("event")
+            prof.begin("update")
+            self.update_loop()
+            prof.end("update")
+            prof.end_frame()
+            ran += 1
+        elapsed = perf_counter() - start
+        results = {"frames": ran, "seconds": round(elapsed, 3),
+                   "fps": round(ran / elapsed, 1) if elapsed else 0.0,
+                   "kills": self.KILL_COUNT, "lives": self.player_lives,
+                   "boss_defeated": self.boss_defeated, "sprites": len(self.all_sprites),
+                   "live": self.live_entities, "entities": entities.registry.counts(),
+                   "culling": entities.registry.stats()}
+        if self.profiler.enabled:
+            results["profile"] = self.profiler.stats()
+            self.profiler.export()
+        return results
+
     def title_screen(self):
         scroll = 0
-        anim = 0
-        ship_image = None
+        anim_timer = 0
+        ship = anim.Playhead("title_ship")
 
         while True:
             title_a = gfx.img_title_a
@@ -701,9 +819,11 @@ class GameControl:
                 self.screen.blit(title_a, (10 - title_size[0] + i * 2, 300))
                 self.screen.blit(title_b, (10 + SCREEN_WIDTH - i * 2, 300))
                 pg.display.flip()
+                gfx.loader.pump()
             snd.load_sound("blow_up.wav")
             for i in range(100):
                 pg.display.update(self.screen.fill(WHITE))
+                gfx.loader.pump()
             self.screen.blit(gfx.img_title_background, (0, 0))
             snd.play_song("title_song.ogg")
             break
@@ -720,24 +840,23 @@ class GameControl:
             self.screen.blit(gfx.img_title_whole, (SCREEN_CENTER[0] - gfx.img_title_whole.get_width() / 2 + 20, 300))
 
             for _ in range(1):
-                if anim < 20:
-                    ship_image = gfx.title_ship_a
-                elif anim > 20:
-                    ship_image = gfx.title_ship_b
-                self.screen.blit(ship_image, (SCREEN_CENTER[0] - (gfx.title_ship_a.get_width() / 2) + 20, 600))
-
-                if anim < 50:
-                    menu = self.font.render("PRESS ENTER", True, WHITE)
+                self.screen.blit(ship.image, (SCREEN_CENTER[0] - (ship.image.get_width() / 2) + 20, 600))
+                ship.advance()
+
+                if anim_timer < 50:
+                    menu = gfx.render_text(self.font, "PRESS ENTER", True, WHITE)
                     self.screen.blit(menu, (SCREEN_CENTER[0] - menu.get_width() / 2, SCREEN_CENTER[1]))
-                elif anim > 50:
-                    menu = self.font.render("PRESS ENTER", True, BLACK)
+                elif anim_timer > 50:
+                    menu = gfx.render_text(self.font, "PRESS ENTER", True, BLACK)
                     self.screen.blit(menu, (SCREEN_CENTER[0] - menu.get_width() / 2, SCREEN_CENTER[1]))
 
-            anim += 1
-            if anim >= 100:
-                anim = 0
+            anim_timer += 1
+            if anim_timer >= 100:
+                anim_timer = 0
 
+            snd.update_music()
             pg.display.update()
+            gfx.loader.pump()
 
             e = pg.event.poll()
             if e.type == pg.KEYDOWN:
@@ -752,10 +871,10 @@ class GameControl:
                     break
 
         while True:
-            text = self.font.render("GET READY", True, WHITE)
+            text = gfx.render_text(self.font, "GET READY", True, WHITE)
             count_list = ["5", "4", "3", "2", "1", "GO!"]
             for i in range(6):
-                countdown = self.font.render(count_list[i], True, WHITE)
+                countdown = gfx.render_text(self.font, count_list[i], True, WHITE)
                 self.screen.fill(BLACK)
                 self.screen.blit(text, (SCREEN_CENTER[0] - text.get_width() / 2, SCREEN_CENTER[1]))
                 self.screen.blit(countdown, (SCREEN_CENTER[0] - countdown.get_width() / 2, SCREEN_CENTER[1] + 30))
@@ -768,25 +887,23 @@ class GameControl:
         self.started = True
 
     def game_over(self):
-        pg.mixer.music.stop()
+        snd.stop_music()
         snd.load_sound("music/death.ogg")
         self.screen.fill((255, 255, 255))
         for i in range(255):
             self.screen.fill((255 - i, 255 - i, 255 - i))
             pg.display.update()
-        import glob
-        for image in sorted(glob.glob(path.join("graphics/GAMEOVER", "*.png"))):
+        for part in anim.frames("gameover"):
             self.screen.fill(BLACK)
-            part = pg.image.load(image).convert()
             self.screen.blit(part, (SCREEN_CENTER[0] - 250, SCREEN_CENTER[1]))
             pg.display.update()
         pg.time.wait(2000)
 
     def end_message(self):
-        pg.mixer.music.stop()
+        snd.stop_music()
         snd.load_sound("music/winning.ogg")
 
-        message = self.font.render("Thanks for playing!", True, WHITE)
+        message = gfx.render_text(self.font, "Thanks for playing!", True, WHITE)
         self.screen.blit(message, SCREEN_CENTER)
 
         pg.display.flip()
@@ -795,12 +912,39 @@ class GameControl:
     def loop(self):
         if self._is_running:
             self.title_screen()
+            self.on_loaded()
             # if self.started:
             #     self.start_time = time()
+            # Fixed simulation steps, rendering as often as the display allows
+            step = 1000.0 / self.FPS
+            accumulator = 0.0
+            prof = self.profiler
+            self.clock.tick()
             while self._is_running:
-                self.on_event()
-                self.update_loop()
-                self.on_render()
+                prof.begin_frame()
+                prof.begin("tick")
+                accumulator += self.clock.tick(self.RENDER_FPS)
+                prof.end("tick")
+                steps = 0
+                while accumulator >= step and self._is_running:
+                    if steps == self.MAX_STEPS:
+                        # Too far behind, drop the backlog rather than spiral
+                        accumulator = 0.0
+                        break
+                    self.snapshot()
+                    prof.begin("event")
+                    self.on_event()
+                    prof.end("event")
+                    prof.begin("update")
+                    self.update_loop()
+                    prof.end("update")
+                    accumulator -= step
+                    steps += 1
+                snd.update_music()
+                prof.begin("render")
+                self.on_render(accumulator / step)
+                prof.end("render")
+                prof.end_frame()
 
         if self.boss_defeated:
             self.end_message()
@@ -811,5 +955,9 @@ class GameControl:
 if __name__ == "__main__":
     game = GameControl()
     game.on_init()
-    game.loop()
-    game.on_cleanup()
+    if gfx.headless:
+        print(game.run_headless(int(argv[1]) if len(argv) > 1 else 10000))
+        pg.quit()
+    else:
+        game.loop()
+        game.on_cleanup()
@@ -1,17 +1,19 @@
 from random import choice
-from time import clock
 
 import pygame as pg
 
+import collision
+import entities
 import gfx
-import main
+import helper_functions
 from constants import SCREEN_WIDTH, SCREEN_HEIGHT
-from snd import load_sound
+from snd import load_sound, CRITICAL
 
 
-class Player(pg.sprite.Sprite):
-    allBullets = pg.sprite.Group()
+class Player(collision.MaskedSprite):
+    allBullets = entities.registry.group("player_bullets")
     start_position = SCREEN_HEIGHT + 200
+    trails = {}
 
     def __init__(self):
         pg.sprite.Sprite.__init__(self)
@@ -31,9 +33,10 @@ class Player(pg.sprite.Sprite):
         self.last_y = 0
         self.dead = False
         self.respawn = False
+        self.hold_start = None
         self.invulnerable = False
         self.invulnerable_timer = 0
-        self.dead_timer = pg.time.get_ticks()
+        self.dead_timer = helper_functions.ticks()
         self.cool_down = 0
         self.power_level = 1
         self.t = 0
@@ -159,80 +162,69 @@ class Player(pg.sprite.Sprite):
         if self.rect.bottom < 900:
             self.rect.bottom = 900
             self.dy = 0
-            duration = 2.0
-            current_time = clock()
-            if current_time > duration:
+            # Held on the line for two seconds of game time before control is handed over
+            if self.hold_start is None:
+                self.hold_start = helper_functions.ticks()
+            if helper_functions.ticks() - self.hold_start > 2000:
+                self.hold_start = None
                 self.arrive = False
                 self.respawn = False
 
     def draw_trail(self, length, offset):
-        last_x = self.rect.centerx
-        last_y = self.rect.bottom
-        pg.draw.line(gfx.screen, (65, 255, 255), (last_x - offset, last_y - 5), (last_x - offset, last_y + length), 5)
-        pg.draw.line(gfx.screen, (65, 255, 255), (last_x + offset, last_y - 5), (last_x + offset, last_y + length), 5)
-        pg.draw.aaline(gfx.screen, (255, 255, 255), (last_x - offset, last_y - 5),
-                       (last_x - offset, last_y + length + 5), True)
-        pg.draw.aaline(gfx.screen, (255, 255, 255), (last_x + offset, last_y - 5),
-                       (last_x + offset, last_y + length + 5), True)
-        pg.display.update()
+        # Drawn once per length and offset, then handed to the renderer as an effect behind the ship
+        trail = self.trails.get((length, offset))
+        if trail is None:
+            trail = pg.Surface((offset * 2 + 7, length + 11), pg.SRCALPHA)
+            left, right = 3, offset * 2 + 3
+            pg.draw.line(trail, (65, 255, 255), (left, 0), (left, length + 5), 5)
+            pg.draw.line(trail, (65, 255, 255), (right, 0), (right, length + 5), 5)
+            pg.draw.aaline(trail, (255, 255, 255), (left, 0), (left, length + 10), True)
+            pg.draw.aaline(trail, (255, 255, 255), (right, 0), (right, length + 10), True)
+            self.trails[(length, offset)] = trail
+        gfx.effects.submit(trail, (self.rect.centerx - offset - 3, self.rect.bottom - 5), behind=True)
+
+    def fire(self, x, y, image, dy):
+        return entities.registry.spawn(entities.bullets.acquire(x, y, image, 0, dy), "player_bullets")
 
     def shoot(self):
         if not self.dead and not self.arrive:
             self.shooting = True
-            if self.power_level == 1 and (pg.time.get_ticks() > self.cool_down + 100):
-                self.cool_down = pg.time.get_ticks()
+            if self.power_level == 1 and (helper_functions.ticks() > self.cool_down + 100):
+                self.cool_down = helper_functions.ticks()
                 load_sound("pewpew.wav")
-                new_bullet1 = main.Bullet(self.rect.centerx - 5, self.rect.bottom - self.size[1],
-                                          gfx.img_bullet)
-                new_bullet2 = main.Bullet(self.rect.centerx + 5, self.rect.bottom - self.size[1],
-                                          gfx.img_bullet)
-                new_bullet1.dy = -15
-                new_bullet2.dy = -15
-                self.allBullets.add(new_bullet1, new_bullet2)
-            elif self.power_level == 2 and (pg.time.get_ticks() > self.cool_down + 20):
+                top = self.rect.bottom - self.size[1]
+                self.fire(self.rect.centerx - 5, top, gfx.img_bullet, -15)
+                self.fire(self.rect.centerx + 5, top, gfx.img_bullet, -15)
+            elif self.power_level == 2 and (helper_functions.ticks() > self.cool_down + 20):
                 self.t += 1
-                self.cool_down = pg.time.get_ticks()
-                new_bullet1 = main.Bullet(self.rect.centerx - 10, self.rect.bottom - self.size[1],
-                                          gfx.img_bullet_2)
-                new_bullet2 = main.Bullet(self.rect.centerx + 10, self.rect.bottom - self.size[1],
-                                          gfx.img_bullet_2)
-                new_bullet3 = main.Bullet(self.rect.centerx - 25, self.rect.bottom - self.size[1],
-                                          gfx.img_bullet_2)
-                new_bullet4 = main.Bullet(self.rect.centerx + 25, self.rect.bottom - self.size[1],
-                                          gfx.img_bullet_2)
-
-                new_bullet1.dy = -10
-                new_bullet2.dy = -10
-                new_bullet3.dy = -10
-                new_bullet4.dy = -10
+                self.cool_down = helper_functions.ticks()
+                top = self.rect.bottom - self.size[1]
 
+                # Inner pair on the second tick, outer pair on the fourth
                 if self.t == 2:
-                    self.allBullets.add(new_bullet1)
-                    self.allBullets.add(new_bullet2)
+                    self.fire(self.rect.centerx - 10, top, gfx.img_bullet_2, -10)
+                    self.fire(self.rect.centerx + 10, top, gfx.img_bullet_2, -10)
                     load_sound("pewpew2.wav")
                 if self.t == 4:
-                    self.allBullets.add(new_bullet3)
-                    self.allBullets.add(new_bullet4)
+                    self.fire(self.rect.centerx - 25, top, gfx.img_bullet_2, -10)
+                    self.fire(self.rect.centerx + 25, top, gfx.img_bullet_2, -10)
                     load_sound("pewpew2.wav")
                 if self.t > 5:
                     self.t = 0
-            elif self.power_level >= 3 and (pg.time.get_ticks() > self.cool_down + 50):
+            elif self.power_level >= 3 and (helper_functions.ticks() > self.cool_down + 50):
                 self.t += 1
-                self.cool_down = pg.time.get_ticks()
-
-                new_bullet = main.Bullet(self.rect.centerx - 60, self.rect.y, gfx.img_bullet_3)
-                new_bullet.dy = -20
-                new_bullet.image = pg.transform.scale(new_bullet.image, (150, 100))
+                self.cool_down = helper_functions.ticks()
 
                 if self.t >= 4:
-                    self.allBullets.add(new_bullet)
+                    new_bullet = self.fire(self.rect.centerx - 60, self.rect.y, gfx.img_bullet_3, -20)
+                    new_bullet.image = gfx.scale(new_bullet.image, (150, 100))
                     load_sound("pewpew3.wav")
                     self.t = 0
 
     def die(self):
         self.last_x = self.rect.x
         self.last_y = self.rect.y
-        load_sound("explode.wav")
-        gfx.explosion(self.last_x, self.last_y)
+        load_sound("explode.wav", CRITICAL)
+        entities.Explosion(self.last_x, self.last_y)
         self.power_level = 1
         self.dead = True
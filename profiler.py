@@ -0,0 +1,153 @@
+import csv
+import json
+from collections import deque
+from os import environ
+from time import perf_counter_ns
+
+import pygame as pg
+
+
+class NullProfiler:
+    # Stands in while profiling is off, instrumented code then pays one empty call per mark
+    enabled = False
+    overlay = False
+
+    def begin_frame(self):
+        pass
+
+    def begin(self, phase):
+        pass
+
+    def lap(self, name):
+        pass
+
+    def end(self, phase):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def render_overlay(self, font):
+        return None
+
+    def stats(self):
+        return {}
+
+    def export(self, file=None):
+        return None
+
+
+class Profiler:
+    # Nanosecond phase timings per frame. A lap closes the stretch of the current phase since the last
+    # mark under "phase.lap", and phases that run more than once in a frame, like update steps, add up.
+    enabled = True
+    WINDOW = 600
+    # Frames kept for export, about a minute at 60 fps. None keeps every frame.
+    HISTORY = 3600
+    OVERLAY_REFRESH = 30
+    OVERLAY_COLOR = (255, 255, 0)
+
+    def __init__(self, window=WINDOW, history=HISTORY, export_file=None):
+        self.window = window
+        self.samples = {}
+        self.history = deque(maxlen=history)
+        self.export_file = export_file
+        self.overlay = False
+        self.frames = 0
+        self.record = {}
+        self.frame_start = 0
+        self.phase = "frame"
+        self.phase_start = 0
+        self.last = 0
+        self.overlay_surface = None
+        self.overlay_frame = 0
+
+    def begin_frame(self):
+        self.record = {}
+        self.frame_start = perf_counter_ns()
+
+    def begin(self, phase):
+        self.phase = phase
+        self.phase_start = self.last = perf_counter_ns()
+
+    def lap(self, name):
+        now = perf_counter_ns()
+        key = self.phase + "." + name
+        self.record[key] = self.record.get(key, 0) + now - self.last
+        self.last = now
+
+    def end(self, phase):
+        now = perf_counter_ns()
+        self.record[phase] = self.record.get(phase, 0) + now - self.phase_start
+        self.phase = "frame"
+
+    def end_frame(self):
+        record = self.record
+        record["frame"] = perf_counter_ns() - self.frame_start
+        self.frames += 1
+        self.history.append(record)
+        for name, ns in record.items():
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+            samples.append(ns)
+
+    def percentiles(self, name, points=(.5, .95, .99)):
+        samples = sorted(self.samples.get(name, ()))
+        if not samples:
+            return None
+        return [samples[min(len(samples) - 1, int(point * len(samples)))] for point in points]
+
+    def stats(self):
+        # p50, p95 and p99 in milliseconds over the last window frames
+        return {name: [round(ns / 1e6, 3) for ns in self.percentiles(name)] for name in sorted(self.samples)}
+
+    def render_overlay(self, font):
+        # Rebuilt every OVERLAY_REFRESH frames, figures changing every frame could not be read anyway
+        if not self.overlay:
+            return None
+        if self.overlay_surface is None or self.frames - self.overlay_frame >= self.OVERLAY_REFRESH:
+            lines = ["ms  p50 / p95 / p99"]
+            for name, values in self.stats().items():
+                lines.append(name + "  " + " / ".join(str(value) for value in values))
+            rendered = [font.render(line, True, self.OVERLAY_COLOR) for line in lines]
+            height = font.get_linesize()
+            surf = pg.Surface((max(line.get_width() for line in rendered) + 10, height * len(lines) + 10),
+                              pg.SRCALPHA)
+            surf.fill((0, 0, 0, 160))
+            surf.blits([(line, (5, 5 + i * height)) for i, line in enumerate(rendered)], False)
+            self.overlay_surface = surf
+            self.overlay_frame = self.frames
+        return self.overlay_surface
+
+    def export(self, file=None):
+        # One row per frame in nanoseconds, only the last history frames though. The index column counts
+        # from the first profiled frame, and a .json file also gets the rolling percentiles and frame totals.
+        file = file or self.export_file
+        if not file:
+            return None
+        first = self.frames - len(self.history)
+        if file.endswith(".json"):
+            with open(file, "w") as f:
+                json.dump({"percentiles_ms": self.stats(), "frames": self.frames, "dropped_frames": first,
+                           "frames_ns": [dict(record, index=first + i) for i, record in enumerate(self.history)]}, f)
+        else:
+            names = sorted(set(name for record in self.history for name in record))
+            with open(file, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["index"] + names)
+                for i, record in enumerate(self.history):
+                    writer.writerow([first + i] + [record.get(name, "") for name in names])
+        return file
+
+
+def from_environ(name="GALBLAZER_PROFILE"):
+    # Unset or 0 leaves profiling off, any other value turns it on and a .csv or .json value names the export.
+    # GALBLAZER_PROFILE_HISTORY sets how many frames the export keeps, 0 keeps them all.
+    value = environ.get(name, "")
+    if value in ("", "0"):
+        return NullProfiler()
+    history = int(environ.get(name + "_HISTORY", Profiler.HISTORY)) or None
+    if value.endswith((".csv", ".json")):
+        return Profiler(history=history, export_file=value)
+    return Profiler(history=history)
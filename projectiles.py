@@ -0,0 +1,96 @@
+import numpy as np
+
+
+class Projectiles:
+    # Projectiles as parallel NumPy arrays, moved, culled and hit-tested in bulk instead of one sprite each
+    def __init__(self, capacity=4096, bounds=(0, 0, 800, 1080), margin=50):
+        self.capacity = capacity
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.dx = np.zeros(capacity)
+        self.dy = np.zeros(capacity)
+        self.kind = np.zeros(capacity, dtype=np.intp)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.frames = []
+        self.sizes = np.zeros((0, 2))
+        left, top, width, height = bounds
+        self.limits = (left - margin, top - margin, left + width + margin, top + height + margin)
+        self.culled = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def add_kind(self, frames):
+        # Kinds with several frames flicker between them at random
+        self.frames.append(list(frames))
+        self.sizes = np.vstack([self.sizes, frames[0].get_size()])
+        return len(self.frames) - 1
+
+    def spawn(self, x, y, dx, dy, kind):
+        if not self.free:
+            self.dropped += 1
+            return -1
+        i = self.free.pop()
+        self.x[i] = x
+        self.y[i] = y
+        self.dx[i] = dx
+        self.dy[i] = dy
+        self.kind[i] = kind
+        self.alive[i] = True
+        return i
+
+    def kill(self, indices):
+        indices = indices[self.alive[indices]]
+        self.alive[indices] = False
+        self.free.extend(indices.tolist())
+
+    def clear(self, kind=None):
+        # Every live projectile, or only those of one kind
+        if kind is None:
+            self.kill(np.flatnonzero(self.alive))
+        else:
+            self.kill(np.flatnonzero(self.alive & (self.kind == kind)))
+
+    def step(self):
+        # Dead slots move too, it is cheaper than masking them out
+        self.x += self.dx
+        self.y += self.dy
+        left, top, right, bottom = self.limits
+        out = self.alive & ((self.x < left) | (self.x > right) | (self.y < top) | (self.y > bottom))
+        culled = np.flatnonzero(out)
+        self.culled += culled.size
+        self.kill(culled)
+
+    def boxes(self, indices, alpha=1.0):
+        # Top left corners and sizes, alpha places them between the last two steps
+        sizes = self.sizes[self.kind[indices]]
+        left = self.x[indices] - (1 - alpha) * self.dx[indices] - sizes[:, 0] / 2
+        top = self.y[indices] - (1 - alpha) * self.dy[indices] - sizes[:, 1] / 2
+        return left.astype(int), top.astype(int), sizes[:, 0].astype(int), sizes[:, 1].astype(int)
+
+    def collide(self, rect):
+        # Indices of live projectiles whose boxes overlap rect
+        live = np.flatnonzero(self.alive)
+        left, top, width, height = self.boxes(live)
+        hit = (left < rect.right) & (left + width > rect.left) & (top < rect.bottom) & (top + height > rect.top)
+        return live[hit]
+
+    def rects(self, alpha=1.0):
+        live = np.flatnonzero(self.alive)
+        return zip(*(a.tolist() for a in self.boxes(live, alpha)))
+
+    def draw(self, surface, alpha=1.0):
+        live = np.flatnonzero(self.alive)
+        if not live.size:
+            return
+        left, top, _, _ = self.boxes(live, alpha)
+        flicker = np.random.randint(0, 2 ** 16, live.size).tolist()
+        frames = self.frames
+        surface.blits([(frames[k][r % len(frames[k])], (x, y))
+                       for k, r, x, y in zip(self.kind[live].tolist(), flicker, left.tolist(), top.tolist())],
+                      False)
+
+    def stats(self):
+        return {"live": len(self), "capacity": self.capacity, "culled": self.culled, "dropped": self.dropped}
@@ -1,5 +1,11 @@
 import pygame as pg
+import threading
+from glob import glob
+from io import BytesIO
 from os import path
+from time import perf_counter
+
+from constants import MIXER_CHANNELS, MUSIC_FADE_MS
 
 # Sounds Library
 # shoot = pg.mixer.Sound('pewpew.wav')
@@ -8,13 +14,262 @@ from os import path
 # big_explode = pg.mixer.Sound('blow_up.wav')
 
 
-def load_sound(FILENAME):
+class SoundBank:
+    # Decoded effects kept in memory by file name, so gameplay never touches the disk
+    def __init__(self, directory="sounds"):
+        self.directory = directory
+        self.sounds = {}
+        self.hits = 0
+        self.misses = 0
+
+    def preload(self):
+        for file in sorted(glob(path.join(self.directory, "*.wav"))):
+            name = path.basename(file)
+            if name not in self.sounds:
+                self.sounds[name] = pg.mixer.Sound(file)
+        return len(self.sounds)
+
+    def get(self, FILENAME):
+        sound = self.sounds.get(FILENAME)
+        if sound is None:
+            self.misses += 1
+            sound = pg.mixer.Sound(path.join(self.directory, FILENAME))
+            self.sounds[FILENAME] = sound
+        else:
+            self.hits += 1
+        return sound
+
+    def stats(self):
+        return {"loaded": len(self.sounds), "hits": self.hits, "misses": self.misses}
+
+
+# Voice priorities, a busy mixer gives up lower voices for higher ones
+LOW = 0
+NORMAL = 1
+HIGH = 2
+CRITICAL = 3
+
+PRIORITIES = {
+    "hit.wav": LOW,
+    "enemy_shoot.wav": LOW,
+    "charging.wav": NORMAL,
+    "firing_beam.wav": NORMAL,
+    "pewpew.wav": NORMAL,
+    "pewpew2.wav": NORMAL,
+    "pewpew3.wav": NORMAL,
+    "explode.wav": HIGH,
+    "powerup.wav": HIGH,
+    "leave_hyperspace.wav": HIGH,
+    "blow_up.wav": CRITICAL,
+    "takeoff.wav": CRITICAL,
+}
+
+# Minimum time in ms before the same sound may start again
+MIN_INTERVALS = {
+    "hit.wav": 60,
+    "enemy_shoot.wav": 50,
+    "charging.wav": 3000,
+    "firing_beam.wav": 80,
+    "explode.wav": 40,
+    "leave_hyperspace.wav": 4200,
+}
+
+
+class VoiceManager:
+    def __init__(self, sounds, channels=MIXER_CHANNELS):
+        self.sounds = sounds
+        self.channels = []
+        self.voices = {}
+        self.last_played = {}
+        self.priorities = dict(PRIORITIES)
+        self.min_intervals = dict(MIN_INTERVALS)
+        self.num_channels = channels
+        self.played = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.stolen = 0
+
+    def set_channels(self, channels):
+        pg.mixer.set_num_channels(channels)
+        self.num_channels = channels
+        self.channels = [pg.mixer.Channel(i) for i in range(channels)]
+        self.voices = {}
+
+    def free_channel(self):
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                return i
+        return None
+
+    def steal_channel(self, priority):
+        # Oldest voice of the lowest priority class that does not outrank the request
+        victim = None
+        for i, (started, voice_priority, name) in self.voices.items():
+            if voice_priority > priority:
+                continue
+            if victim is None or (voice_priority, started) < victim[1]:
+                victim = (i, (voice_priority, started))
+        if victim is None:
+            return None
+        return victim[0]
+
+    def play(self, FILENAME, priority=None):
+        if not self.channels:
+            self.set_channels(self.num_channels)
+
+        if priority is None:
+            priority = self.priorities.get(FILENAME, NORMAL)
+
+        now = pg.time.get_ticks()
+        # A request that outranks the last start of the same sound always gets through
+        last = self.last_played.get(FILENAME)
+        if last is not None and priority <= last[1] and now - last[0] < self.min_intervals.get(FILENAME, 0):
+            self.coalesced += 1
+            return None
+
+        index = self.free_channel()
+        if index is None:
+            index = self.steal_channel(priority)
+            if index is None:
+                self.dropped += 1
+                return None
+            self.stolen += 1
+
+        channel = self.channels[index]
+        channel.play(self.sounds.get(FILENAME))
+        self.voices[index] = (now, priority, FILENAME)
+        self.last_played[FILENAME] = (now, priority)
+        self.played += 1
+        return channel
+
+    def stats(self):
+        busy = sum(1 for channel in self.channels if channel.get_busy())
+        return {"channels": self.num_channels, "busy": busy, "played": self.played,
+                "coalesced": self.coalesced, "dropped": self.dropped, "stolen": self.stolen}
+
+
+# Tracks read ahead of time, in the order the game reaches them
+PLAYLIST = ["title_song.ogg", "saturns_folly.ogg", "deadly_opposition.ogg"]
+
+
+class MusicManager:
+    # Track files are read into memory on a background thread, so a switch never waits on the disk.
+    # The mixer streams one track at a time, so a transition ramps the old one down, then fades the new one in.
+    def __init__(self, directory=path.join("sounds", "music"), fade_ms=MUSIC_FADE_MS):
+        self.directory = directory
+        self.fade_ms = fade_ms
+        self.volume = 1.0
+        self.data = {}
+        self.thread = None
+        self.stream = None
+        self.current = None
+        self.pending = None
+        self.switches = []
+
+    def prefetch(self, names=PLAYLIST):
+        names = [name for name in names if name not in self.data]
+
+        def read():
+            for name in names:
+                with open(path.join(self.directory, name), "rb") as f:
+                    # One dict store per track, the main thread only ever sees whole files
+                    self.data[name] = f.read()
+
+        self.thread = threading.Thread(target=read, name="music-prefetch")
+        self.thread.daemon = True
+        self.thread.start()
+        return self.thread
+
+    def play(self, name, fade_ms=None):
+        if fade_ms is None:
+            fade_ms = self.fade_ms
+        if self.pending is None and name == self.current:
+            return
+        now = pg.time.get_ticks()
+        # A newer request takes over a fade already in progress instead of restarting it
+        started = self.pending[2] if self.pending is not None else now
+        self.pending = (name, fade_ms, started, now)
+
+    def update(self):
+        # Called every frame, the switch itself happens once the old track is silent
+        if self.pending is None:
+            return
+        name, fade_ms, started, requested = self.pending
+        elapsed = pg.time.get_ticks() - started
+        if fade_ms and pg.mixer.music.get_busy() and elapsed < fade_ms:
+            pg.mixer.music.set_volume(self.volume * (1 - elapsed / float(fade_ms)))
+            return
+        self.switch(name, fade_ms, requested)
+
+    def switch(self, name, fade_ms, requested):
+        start = perf_counter()
+        data = self.data.get(name)
+        pg.mixer.music.stop()
+        if data is not None:
+            # The mixer keeps reading from the stream while it plays, so it is held here
+            self.stream = BytesIO(data)
+            pg.mixer.music.load(self.stream, "ogg")
+        else:
+            self.stream = None
+            pg.mixer.music.load(path.join(self.directory, name))
+        pg.mixer.music.set_volume(self.volume)
+        pg.mixer.music.play(-1, 0.0, fade_ms)
+        self.switches.append({"track": name, "prefetched": data is not None,
+                              "load_ms": round((perf_counter() - start) * 1000, 2),
+                              "latency_ms": pg.time.get_ticks() - requested})
+        self.current = name
+        self.pending = None
+
+    def stop(self):
+        self.pending = None
+        self.current = None
+        pg.mixer.music.stop()
+
+    def stats(self):
+        return {"current": self.current, "prefetched": sorted(self.data), "switches": list(self.switches)}
+
+
+bank = SoundBank()
+voices = VoiceManager(bank)
+music = MusicManager()
+# Cleared for headless runs, where the mixer is never opened
+enabled = True
+
+
+def preload_sounds():
+    if not enabled:
+        return 0
+    return bank.preload()
+
+
+def set_channels(channels):
+    voices.set_channels(channels)
+
+
+def load_sound(FILENAME, priority=None):
+
+    if not enabled:
+        return None
+    return voices.play(FILENAME, priority)
+
+def prefetch_music(names=PLAYLIST):
+    if not enabled:
+        return None
+    return music.prefetch(names)
+
+
+def play_song(FILENAME, fade_ms=None):
+
+    if not enabled:
+        return
+    music.play(str(FILENAME), fade_ms)
+
 
-    sound = pg.mixer.Sound(path.join("sounds/", FILENAME))
-    sound.play()
+def update_music():
+    if enabled:
+        music.update()
 
-def play_song(FILENAME):
 
-    pg.mixer.music.stop()
-    pg.mixer.music.load(path.join("sounds/", "music/", str(FILENAME)))
-    pg.mixer.music.play(-1)
\ No newline at end of file
+def stop_music():
+    if enabled:
+        music.stop()
@@ -0,0 +1,131 @@
+import numpy as np
+
+
+def round_rect(values):
+    # Rounds the way pygame does when a float is assigned to a Rect, half away from zero
+    return np.trunc(values + np.copysign(.5, values))
+
+
+class Squadron:
+    # Movement state for every enemy of one type as parallel arrays, each sprite keeps only its slot
+    FIELDS = {"x": float, "y": float, "w": float, "h": float, "half": float, "dx": float, "dy": float}
+
+    def __init__(self, capacity=64, bounds=(0, 0, 800, 1080)):
+        self.bounds = bounds
+        self.capacity = 0
+        self.alive = np.zeros(0, dtype=bool)
+        for name, dtype in self.FIELDS.items():
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        self.sprites = []
+        self.free = []
+        self.grow(capacity)
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def grow(self, capacity):
+        extra = capacity - self.capacity
+        for name in list(self.FIELDS) + ["alive"]:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros(extra, dtype=array.dtype)]))
+        self.sprites.extend([None] * extra)
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def attach(self, sprite, dx=0, dy=0):
+        if not self.free:
+            self.grow(self.capacity * 2)
+        i = self.free.pop()
+        for name in self.FIELDS:
+            getattr(self, name)[i] = 0
+        self.x[i], self.y[i] = sprite.rect.topleft
+        self.w[i], self.h[i] = sprite.rect.size
+        # x + half is the rect centerx
+        self.half[i] = sprite.rect.w // 2
+        self.dx[i] = dx
+        self.dy[i] = dy
+        self.alive[i] = True
+        self.sprites[i] = sprite
+        return i
+
+    def release(self, i):
+        if self.alive[i]:
+            self.alive[i] = False
+            self.sprites[i] = None
+            self.free.append(i)
+
+    def sync(self, indices):
+        # Collision and drawing read the sprite rects, so the new positions are copied back
+        sprites = self.sprites
+        for i, x, y in zip(indices.tolist(), self.x[indices].tolist(), self.y[indices].tolist()):
+            sprites[i].rect.topleft = (x, y)
+
+    def kill(self, indices):
+        for i in indices.tolist():
+            self.sprites[i].kill()
+
+
+class FighterSquadron(Squadron):
+    FIELDS = dict(Squadron.FIELDS, change=float, angle=float, has_shot=bool)
+    # Fighters slow down past the cruise line and peel off towards the nearer edge once they have shot
+    CRUISE_LINE = 300
+    CRUISE_SPEED = 2
+    BREAK_SPEED = 4
+    TURN_RATE = .1
+    # Firing window: at most this far above and to the left of the target, and no lower than FIRE_FLOOR
+    FIRE_RANGE = (300, 500)
+    FIRE_FLOOR = 900
+
+    def step(self):
+        # Whole arrays under a mask, dead slots are cheaper to carry along than to gather out
+        if not len(self):
+            return
+        left, top, width, height = self.bounds
+        x, y, w, dy, change = self.x, self.y, self.w, self.dy, self.change
+        moving = self.alive & (y < top + height)
+        dy[moving & (y + self.h > self.CRUISE_LINE)] = self.CRUISE_SPEED
+        turning = moving & self.has_shot
+        dy[turning] = self.BREAK_SPEED
+        change += turning * np.where(x + self.half > left + width / 2, self.TURN_RATE, -self.TURN_RATE)
+        gone = self.alive & ~moving | moving & ((x <= left) | (x + w >= left + width))
+
+        x[moving] = round_rect(x + self.dx + change)[moving]
+        y += dy * moving
+        self.angle += np.degrees(change) / 180 * moving
+
+        self.sync(moving.nonzero()[0])
+        if gone.any():
+            self.kill(gone.nonzero()[0])
+
+    def fire(self, target):
+        # Fighters entering the firing window this step, paired with their aim angles
+        if not len(self):
+            return []
+        above, across = self.FIRE_RANGE
+        window = (self.alive & ~self.has_shot & (target.rect.y - (self.y + self.h) <= above) &
+                  (target.rect.centerx - (self.x + self.half) <= across) & (self.y <= self.FIRE_FLOOR))
+        if not window.any():
+            return []
+        firing = window.nonzero()[0]
+        self.has_shot[firing] = True
+        angles = np.arctan2(target.rect.y - self.y[firing], target.rect.x - self.x[firing])
+        return [(self.sprites[i], angle) for i, angle in zip(firing.tolist(), angles.tolist())]
+
+
+class FrigateSquadron(Squadron):
+    def step(self):
+        if not len(self):
+            return
+        left, top, width, height = self.bounds
+        self.x += self.dx
+        self.sync(self.alive.nonzero()[0])
+        gone = self.alive & (self.x >= left + width)
+        if gone.any():
+            self.kill(gone.nonzero()[0])
+
+    def fire(self, target):
+        # Frigates drop a missile whenever they pass straight over the target
+        if not len(self):
+            return []
+        over = self.alive & (self.x + self.half == target.rect.centerx)
+        return [self.sprites[i] for i in over.nonzero()[0].tolist()]